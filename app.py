@@ -1,154 +1,187 @@
-from fastapi import FastAPI, Request
-import random
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import json
+import os
+import threading
 import uuid
-import torch
-from typing import Optional
-from models import GenerateRequest, RecipeOut, BulkRequest, UserPreferences, IngredientLine
-from catalogs import (
-    CAT_PROTEIN, CAT_STARCH, CAT_VEG, FLAVOR_PROFILES, pick_compatible, title_from, qty_for,
-    respects_diet, gluten_swap, choose, estimated_cost, write_instructions, COMPAT
-)
-from ml_service import generate_ml_structured, embedder, get_user_embedding
-from db_service import store_recipe, Session
+from typing import List, Optional
+from models import GenerateRequest, RecipeOut, BulkRequest, BulkJobOut, UserPreferences
+from ml_service import generate_ml_structured, generate_ml_bulk, iter_ml_bulk, expand_bulk_request, embed_texts, generation_version, get_embedder, get_user_embedding, warmup
+from db_service import create_job, get_job, fetch_recipes, find_recipe_id, dispose_async_engine, Session
+from result_cache import request_key, result_cache, source_id_for
+from jobs import job_runner
+from write_behind import persist_recipe, persist_recipes, persist_recipe_async, persist_recipes_async
+import write_behind
 from reco import router as reco_router
+from heuristic import make_router as heuristic_router
+from search import make_router as search_router
+from request_utils import user_uuid_from_headers
+from embedding_cache import recipe_embedding_text
+import embedding_table
+import inference_pool
+import metrics
 
 app = FastAPI(title="Margo-ML")
 app.include_router(reco_router)
 
-def _user_uuid_from_headers(request: Request) -> Optional[str]:
-    for key in ("x-user-id", "x-user-uuid", "x-user"):
-        v = request.headers.get(key)
-        if not v:
-            continue
-        try:
-            _ = uuid.UUID(v)
-            return v
-        except Exception:
-            pass
-    return None
+def _ensure_embeddings(recipes: List[dict]) -> None:
+    # one encode call for every recipe still missing an embedding
+    missing = [(r, recipe_embedding_text(r)) for r in recipes if r.get("embedding") is None]
+    missing = [(r, text) for r, text in missing if text.strip()]
+    if missing:
+        for (r, _), emb in zip(missing, embed_texts([text for _, text in missing])):
+            r["embedding"] = emb
 
 def _ensure_embedding(recipe: dict) -> None:
-    if recipe.get("embedding") is not None:
-        return
-    title = recipe.get("title") or ""
-    ing_names = " ".join((i.get("name") or "") for i in recipe.get("ingredients", []) if isinstance(i, dict))
-    instr = recipe.get("instructions") or ""
-    text = " | ".join(filter(None, [title, ing_names, instr]))
-    if text.strip():
-        recipe["embedding"] = embedder.encode(text, batch_size=32).tolist()
-
-def generate_structured(req: GenerateRequest) -> dict:
-    profile = random.choice(FLAVOR_PROFILES)
-    tech_pool = COMPAT.get(profile["name"], {}).get("tech")
-    user_pref = set(req.techniques) if req.techniques else None
-    if user_pref:
-        inter = list((set(tech_pool) if tech_pool else set(t["techniques"] for t in FLAVOR_PROFILES)) & user_pref)
-        technique = random.choice(inter or list(tech_pool or ["skillet", "sheet-pan", "one-pot"]))
-    else:
-        technique = random.choice(list(tech_pool or ["skillet", "sheet-pan", "one-pot", "stir-fry", "bake"]))
-
-    protein = choose(CAT_PROTEIN, req.diet)
-    if protein["name"] == "Eggs" and technique in {"stir-fry"}:
-        technique = random.choice(["skillet", "bake", "one-pot"])
-
-    allowed_starch = COMPAT.get(profile["name"], {}).get("starch")
-    starch = gluten_swap(
-        pick_compatible(CAT_STARCH, allowed_starch) if allowed_starch else choose(CAT_STARCH, req.diet),
-        req.diet
-    )
+    _ensure_embeddings([recipe])
 
-    allowed_veg = COMPAT.get(profile["name"], {}).get("veg")
-    veg = pick_compatible(CAT_VEG, allowed_veg) if allowed_veg else choose(CAT_VEG, req.diet)
-
-    ingredients = []
-    for it in [protein, starch, veg] + profile["adds"]:
-        ingredients.append(IngredientLine(
-            name=it["name"],
-            qty=qty_for(req.servings, it),
-            unit=it.get("unit", ""),
-            form=None
-        ))
-
-    base_items = [protein, starch, veg] + profile["adds"]
-    cost = min(estimated_cost(req.servings, base_items), req.budgetCents)
-    cook = min(35, req.minutes)
-    prep = max(5, int(0.35 * cook))
-
-    instructions = write_instructions(profile, technique, protein, starch, veg, req.servings, req.minutes)
-    tips = "Use frozen veg if needed; adjust liquid for starch by ~1/4 cup."
-
-    title = title_from(profile, protein, starch, veg, technique)
-    tags = ["budget", "30-min", technique] + profile["tags"]
-
-    recipe = {
-        "id": None,
-        "title": title,
-        "servings": req.servings,
-        "prepMinutes": prep,
-        "cookMinutes": cook,
-        "calories": None,
-        "imageUrl": None,
-        "tags": tags,
-        "instructions": instructions,
-        "tips": tips,
-        "ingredients": [i.model_dump() for i in ingredients],
-        "estimatedCostCents": cost,
-    }
-    return recipe
+app.include_router(heuristic_router(_ensure_embeddings))
+app.include_router(search_router(lambda text: embed_texts([text])[0]))
 
-@app.post("/generate", response_model=RecipeOut)
-def generate(req: GenerateRequest, request: Request):
-    recipe = generate_structured(req)
+def _generate_embedded(req: GenerateRequest) -> dict:
+    recipe = generate_ml_structured(req)
     _ensure_embedding(recipe)
-    user_id = _user_uuid_from_headers(request)
-    recipe["id"] = store_recipe(recipe, user_id=user_id, source="heuristic", source_id=None, session_factory=Session)
     return recipe
 
 @app.post("/generate_ml", response_model=RecipeOut)
-def generate_ml(req: GenerateRequest, request: Request):
-    if req.seed is not None:
-        torch.manual_seed(req.seed)
-    recipe = generate_ml_structured(req)
-    _ensure_embedding(recipe)
-    user_id = _user_uuid_from_headers(request)
-    recipe["id"] = store_recipe(recipe, user_id=user_id, source="margo-ml", source_id=recipe.get("id"), session_factory=Session)
+async def generate_ml(req: GenerateRequest, request: Request):
+    # generation runs on the threadpool; the insert is awaited
+    user_id = user_uuid_from_headers(request)
+    key = request_key(req, generation_version())
+    if key is None:
+        recipe = await run_in_threadpool(_generate_embedded, req)
+        recipe["id"] = await persist_recipe_async(recipe, user_id=user_id, source="margo-ml", source_id=recipe.get("id"))
+        return recipe
+    return await run_in_threadpool(_generate_seeded, req, key, user_id)
+
+def _generate_seeded(req: GenerateRequest, key: str, user_id: Optional[str]) -> dict:
+    # Seeded requests are deterministic: a retry or reload gets the row it
+    # already has, and identical requests share one generation. Stays on the
+    # sync engine: the per-key lock and lookup must wrap the insert.
+    source_id = source_id_for(key)
+    rid = result_cache.stored_id(key, user_id) or find_recipe_id("margo-ml", source_id, user_id, session_factory=Session)
+    if rid is not None:
+        stored = fetch_recipes([rid], session_factory=Session)
+        if stored:
+            result_cache.remember_id(key, user_id, rid)
+            return stored[0]
+    recipe = result_cache.get_or_compute(key, lambda: _generate_embedded(req))
+    with result_cache.lock_for(key):  # concurrent duplicates insert one row
+        rid = result_cache.stored_id(key, user_id) or find_recipe_id("margo-ml", source_id, user_id, session_factory=Session)
+        if rid is None:
+            rid = persist_recipe(recipe, user_id=user_id, source="margo-ml", source_id=source_id, session_factory=Session)
+            result_cache.remember_id(key, user_id, rid)
+    recipe["id"] = rid
     return recipe
 
+def _wants_ndjson(request: Request, stream: bool) -> bool:
+    return stream or "application/x-ndjson" in (request.headers.get("accept") or "")
+
+def _ndjson_bulk(reqs: List[GenerateRequest], user_id: Optional[str]):
+    # Pulled by StreamingResponse one line at a time, so nothing is generated
+    # ahead of the client by more than one streaming batch.
+    for chunk in iter_ml_bulk(reqs):
+        ids = persist_recipes(chunk, user_id=user_id, source="margo-ml", session_factory=Session)
+        for one, rid in zip(chunk, ids):
+            one["id"] = rid
+            yield json.dumps(jsonable_encoder(one)) + "\n"
+
 @app.post("/bulk_ml")
-def bulk_ml(req: BulkRequest, request: Request):
-    if req.seed is not None:
-        random.seed(req.seed)
-        torch.manual_seed(req.seed)
-    out = []
-    seen_titles = set()
-    sv_opts = req.servingsOptions if req.servingsOptions else ([req.servings] if req.servings else [4])
-    user_id = _user_uuid_from_headers(request)
-
-    for _ in range(max(1, req.count)):
-        sv = random.choice(sv_opts)
-        one = generate_ml_structured(GenerateRequest(
-            pantry=req.pantry,
-            budgetCents=req.budgetCents,
-            minutes=req.minutes,
-            servings=sv,
-            diet=req.diet,
-            avoid=req.avoid,
-            techniques=req.techniques,
-            cuisine=req.cuisine,
-            seed=req.seed
-        ))
-        if one["title"] in seen_titles:
-            continue
-        seen_titles.add(one["title"])
-        _ensure_embedding(one)
-        one["id"] = store_recipe(one, user_id=user_id, source="margo-ml", source_id=one.get("id"), session_factory=Session)
-        out.append(one)
+async def bulk_ml(req: BulkRequest, request: Request, stream: bool = False):
+    reqs = expand_bulk_request(req)  # items carry seeds derived from req.seed
+    user_id = user_uuid_from_headers(request)
+    if _wants_ndjson(request, stream):
+        # a sync generator: StreamingResponse iterates it on the threadpool
+        return StreamingResponse(_ndjson_bulk(reqs, user_id), media_type="application/x-ndjson")
+
+    out = await run_in_threadpool(generate_ml_bulk, reqs)  # deduped by title, already embedded
+    ids = await persist_recipes_async(out, user_id=user_id, source="margo-ml")
+    for one, rid in zip(out, ids):
+        one["id"] = rid
     return out
 
+def _job_out(job: dict, include_recipes: bool) -> BulkJobOut:
+    count = max(1, job["request"].get("count", 1))
+    return BulkJobOut(
+        id=job["id"],
+        status=job["status"],
+        count=count,
+        attempted=job["attempted"],
+        stored=len(job["recipeIds"]),
+        progress=round(min(1.0, job["attempted"] / count), 4),
+        error=job["error"],
+        createdAt=job["createdAt"],
+        updatedAt=job["updatedAt"],
+        recipeIds=job["recipeIds"],
+        recipes=fetch_recipes(job["recipeIds"], session_factory=Session) if include_recipes else None,
+    )
+
+@app.post("/bulk_ml/jobs", response_model=BulkJobOut, status_code=202)
+def create_bulk_job(req: BulkRequest, request: Request):
+    job_id = create_job(req.model_dump(), user_id=user_uuid_from_headers(request), owner=job_runner.owner,
+                        session_factory=Session)
+    job_runner.submit(job_id)
+    return _job_out(get_job(job_id, session_factory=Session), include_recipes=False)
+
+@app.get("/bulk_ml/jobs/{job_id}", response_model=BulkJobOut)
+def bulk_job_status(job_id: str, includeRecipes: bool = True):
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="job not found")
+    job = get_job(job_id, session_factory=Session)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return _job_out(job, include_recipes=includeRecipes)
+
+@app.on_event("startup")
+def resume_bulk_jobs():
+    job_runner.resume_pending()
+
+@app.on_event("startup")
+def refresh_embedding_table():
+    # /generate looks embeddings up by combination key. The image ships a table
+    # built at docker build time; MARGO_EMBED_TABLE_AUTOBUILD=1 rebuilds it in
+    # the background when catalogs.py (or the embed model) no longer matches,
+    # at the cost of loading MiniLM and encoding every combination at startup.
+    if os.getenv("MARGO_EMBED_TABLE_AUTOBUILD", "0") == "1" and not embedding_table.is_fresh():
+        encode = lambda texts: get_embedder().encode(texts, batch_size=256)
+        threading.Thread(target=embedding_table.rebuild, args=(encode,), name="margo-embed-table", daemon=True).start()
+
+@app.on_event("startup")
+def warm_models():
+    # Models otherwise load on first use; MARGO_WARMUP=1 loads them in the
+    # background so /health answers immediately while weights are read.
+    if os.getenv("MARGO_WARMUP", "0") == "1":
+        threading.Thread(target=warmup, name="margo-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_inference_pool():
+    inference_pool.shutdown()
+
+@app.on_event("shutdown")
+def flush_write_behind():
+    write_behind.shutdown()
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    await dispose_async_engine()
+
+@app.exception_handler(inference_pool.PoolBusy)
+def pool_busy(request: Request, exc: inference_pool.PoolBusy):
+    # every replica is busy and the router queue is full: ask the client to retry
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 @app.post("/user_embedding")
 def user_embedding(prefs: UserPreferences):
     return get_user_embedding(prefs)
 
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
\ No newline at end of file
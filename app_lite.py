@@ -0,0 +1,31 @@
+# margo-ml/app_lite.py
+# Torch-free entry point for the cheap paths: /generate, /bulk, /rank,
+# /plan/suggest, /recipes/{id}/similar, /health. Run with `uvicorn app_lite:app`.
+from fastapi import FastAPI
+from reco import router as reco_router
+from heuristic import make_router as heuristic_router
+from search import make_router as search_router
+from db_service import dispose_async_engine
+import metrics
+import write_behind
+
+app = FastAPI(title="Margo-ML (lite)")
+app.include_router(reco_router)
+app.include_router(heuristic_router())
+app.include_router(search_router())
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
+@app.on_event("shutdown")
+def flush_write_behind():
+    write_behind.shutdown()
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    await dispose_async_engine()
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
@@ -0,0 +1,121 @@
+# margo-ml/batching.py
+# Micro-batching scheduler: concurrent callers submit prompts, a single worker
+# thread collects them for a short window and runs them as one padded batch.
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+import metrics
+
+BATCH_WINDOW_MS = float(os.getenv("MARGO_BATCH_WINDOW_MS", "20"))
+BATCH_MAX_SIZE = int(os.getenv("MARGO_BATCH_MAX_SIZE", "8"))
+
+
+class _Item:
+    __slots__ = ("prompt", "seed", "future", "enqueued_at")
+
+    def __init__(self, prompt: str, seed: Optional[int]):
+        self.prompt = prompt
+        self.seed = seed
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class GenerationBatcher:
+    """Collects prompts for up to `window_ms` (or `max_batch` prompts) and hands
+    them to `run_batch(prompts, seed)` in one call. Seeded prompts always run
+    alone so their output stays reproducible. With `concurrency` > 1 that many
+    threads form and run batches side by side (one per inference replica)."""
+
+    def __init__(self, run_batch: Callable[[List[str], Optional[int]], List[str]],
+                 window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX_SIZE,
+                 name: str = "generate", concurrency: int = 1):
+        self._run_batch = run_batch
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue[_Item]" = queue.Queue()
+        self._held: deque = deque()  # seeded items pulled while filling a batch
+        self.concurrency = max(1, concurrency)
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+        self._batch_size = metrics.histogram(f"batcher.{name}.batch_size", [1, 2, 4, 8, 16, 32, 64])
+        self._wait_ms = metrics.histogram(f"batcher.{name}.wait_ms")
+        self._run_ms = metrics.histogram(f"batcher.{name}.run_ms")
+        metrics.gauge(f"batcher.{name}.queue_depth", self.queue_depth)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() + len(self._held)
+
+    def submit(self, prompt: str, seed: Optional[int] = None) -> Future:
+        self._ensure_started()
+        item = _Item(prompt, seed)
+        self._queue.put(item)
+        return item.future
+
+    def generate(self, prompt: str, seed: Optional[int] = None) -> str:
+        return self.submit(prompt, seed).result()
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._start_lock:
+            if not self._threads:
+                threads = [threading.Thread(target=self._loop, name=f"margo-batcher-{i}", daemon=True)
+                           for i in range(self.concurrency)]
+                for t in threads:
+                    t.start()
+                self._threads = threads
+
+    def _next(self, timeout: Optional[float]) -> Optional[_Item]:
+        try:
+            return self._held.popleft()
+        except IndexError:
+            pass
+        try:
+            if timeout is None:
+                return self._queue.get()
+            if timeout <= 0:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect(self) -> List[_Item]:
+        first = self._next(None)
+        if first.seed is not None:
+            return [first]
+        batch = [first]
+        deadline = first.enqueued_at + self.window
+        while len(batch) < self.max_batch:
+            item = self._next(deadline - time.monotonic())
+            if item is None:
+                break
+            if item.seed is not None:
+                self._held.append(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            for it in batch:
+                self._wait_ms.observe((started - it.enqueued_at) * 1000)
+            self._batch_size.observe(len(batch))
+            try:
+                texts = self._run_batch([it.prompt for it in batch], batch[0].seed)
+                for it, text in zip(batch, texts):
+                    it.future.set_result(text)
+                if len(texts) != len(batch):
+                    raise RuntimeError(f"batch returned {len(texts)} results for {len(batch)} prompts")
+            except Exception as e:
+                for it in batch:
+                    if not it.future.done():
+                        it.future.set_exception(e)
+            self._run_ms.observe((time.monotonic() - started) * 1000)
@@ -0,0 +1,115 @@
+# margo-ml/bench/bench_ann.py
+# Recall@k vs latency of db_service.search_recipes through the ANN index,
+# against exact search (sequential scan) as ground truth, sweeping
+# hnsw.ef_search or ivfflat.probes per MARGO_ANN_INDEX. Needs a Postgres with
+# pgvector at MARGO_DATABASE_URL. --rows N first loads N synthetic clustered
+# embeddings with source "bench" (deleted afterwards unless --keep) and
+# rebuilds the index; --rows 0 measures the recipes already stored.
+#   python bench/bench_ann.py [--rows 1000000] [--queries 200] [--k 10] [--sweep 10,20,40,80,160]
+#                             [--source bench] [--tag vegan]
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db_service  # noqa: E402
+from db_service import EMBED_DIM, INSERT_CHUNK_ROWS, Recipe, Session, insert_recipe_rows, search_recipes  # noqa: E402
+
+SOURCE = "bench"
+TAGS = ["vegan", "quick", "budget", "spicy", "one-pot"]
+
+
+def _clustered(rng, centers: np.ndarray, n: int, spread: float = 0.35) -> np.ndarray:
+    # points around random centers, roughly how recipe embeddings group by dish
+    pick = rng.integers(len(centers), size=n)
+    return (centers[pick] + spread * rng.standard_normal((n, EMBED_DIM))).astype(np.float32)
+
+
+def load(rows: int, centers: np.ndarray, rng) -> None:
+    start = time.perf_counter()
+    batch = INSERT_CHUNK_ROWS * 10
+    for done in range(0, rows, batch):
+        n = min(batch, rows - done)
+        vecs = _clustered(rng, centers, n)
+        tags = rng.random((n, len(TAGS))) < 0.3
+        chunk = [dict(id=uuid.uuid4(), title=f"bench {done + i}", servings=4, source=SOURCE, embedding=v.tolist(),
+                      details={"tags": [t for t, on in zip(TAGS, row) if on]})
+                 for i, (v, row) in enumerate(zip(vecs, tags))]
+        with Session() as session:
+            insert_recipe_rows(session, chunk)
+            session.commit()
+        print(f"  loaded {done + n}/{rows} rows ({time.perf_counter() - start:.0f}s)", end="\r")
+    print()
+
+
+def cleanup() -> None:
+    with Session() as session:
+        session.execute(sa.delete(Recipe).where(Recipe.source == SOURCE))
+        session.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=0)
+    ap.add_argument("--clusters", type=int, default=1000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--sweep", default=None, help="ef_search (hnsw) or probes (ivfflat) values")
+    ap.add_argument("--source", default=None)
+    ap.add_argument("--tag", action="append", default=[])
+    ap.add_argument("--keep", action="store_true", help="keep the synthetic rows")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    kind = db_service.ANN_INDEX
+    if kind not in ("hnsw", "ivfflat"):
+        sys.exit("set MARGO_ANN_INDEX=hnsw or ivfflat")
+    sweep = [int(x) for x in (args.sweep or ("10,20,40,80,160" if kind == "hnsw" else "1,5,10,20,50")).split(",")]
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.clusters, EMBED_DIM))
+
+    db_service.get_engine()
+    print(f"database={db_service.DATABASE_URL.rsplit('@', 1)[-1]} index={kind}")
+    try:
+        if args.rows:
+            load(args.rows, centers, rng)
+            start = time.perf_counter()
+            print(db_service.create_ann_index(kind))
+            print(f"index built in {time.perf_counter() - start:.1f}s")
+        for name, idx in db_service.search_index_info().items():
+            print(f"{name}: {idx['bytes'] / 2 ** 20:.1f}MiB")
+
+        filters = dict(source=args.source, tags=args.tag)
+        queries = [q.tolist() for q in _clustered(rng, centers, args.queries)]
+        exact, exact_ms = [], []
+        for q in queries:
+            start = time.perf_counter()
+            exact.append({r["id"] for r in search_recipes(q, k=args.k, exact=True, **filters)})
+            exact_ms.append((time.perf_counter() - start) * 1000)
+        print(f"{'exact':>10}  recall 1.000  p50 {np.percentile(exact_ms, 50):8.2f} ms  "
+              f"p95 {np.percentile(exact_ms, 95):8.2f} ms")
+
+        for value in sweep:
+            knob = {"ef_search": value} if kind == "hnsw" else {"probes": value}
+            search_recipes(queries[0], k=args.k, **knob, **filters)  # warm the index pages
+            recalls, ms = [], []
+            for q, truth in zip(queries, exact):
+                start = time.perf_counter()
+                got = search_recipes(q, k=args.k, **knob, **filters)
+                ms.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(truth & {r["id"] for r in got}) / max(1, len(truth)))
+            label = f"{'ef' if kind == 'hnsw' else 'probes'}={value}"
+            print(f"{label:>10}  recall {np.mean(recalls):.3f}  p50 {np.percentile(ms, 50):8.2f} ms  "
+                  f"p95 {np.percentile(ms, 95):8.2f} ms")
+    finally:
+        if args.rows and not args.keep:
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
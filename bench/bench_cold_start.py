@@ -0,0 +1,95 @@
+# margo-ml/bench/bench_cold_start.py
+# Cold start and RSS for each ASGI entry point, each measured in a fresh process.
+#   python bench/bench_cold_start.py [--entries app,app_lite] [--serve] [--warmup]
+# --serve also starts uvicorn and times the first 200 from /health. The full
+# app's resume_bulk_jobs startup hook connects to the database, so serving
+# `app` needs a Postgres at MARGO_DATABASE_URL; the import probe and app_lite
+# need none.
+# --warmup additionally calls ml_service.warmup() after importing the full app.
+#
+# Without a database, 1 vCPU, torch 2.14 (CPU), HF_HUB_OFFLINE=1:
+#   $ HF_HUB_OFFLINE=1 python bench/bench_cold_start.py
+#         app: import 8.09s  process 9.67s  max RSS 827 MB  torch=yes  modules=4384
+#    app_lite: import 1.24s  process 1.50s  max RSS 81 MB  torch=no  modules=638
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PROBE = r"""
+import json, resource, sys, time
+t0 = time.perf_counter()
+import importlib
+mod = importlib.import_module(sys.argv[1])
+t1 = time.perf_counter()
+warm = None
+if sys.argv[2] == "1":
+    import ml_service
+    ml_service.warmup()
+    warm = time.perf_counter() - t1
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"import_s": t1 - t0, "warmup_s": warm, "max_rss_mb": rss_kb / 1024,
+                  "torch_loaded": "torch" in sys.modules, "modules": len(sys.modules)}))
+"""
+
+
+def probe(entry: str, warmup: bool) -> dict:
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", PROBE, entry, "1" if warmup else "0"],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    res["process_s"] = time.perf_counter() - start
+    return res
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(entry: str, timeout: float = 120.0) -> float:
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", f"{entry}:app", "--port", str(port)],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"{entry} did not become healthy in {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", default="app,app_lite")
+    ap.add_argument("--serve", action="store_true")
+    ap.add_argument("--warmup", action="store_true")
+    args = ap.parse_args()
+
+    for entry in [e.strip() for e in args.entries.split(",") if e.strip()]:
+        r = probe(entry, args.warmup and entry == "app")
+        line = (f"{entry:>9}: import {r['import_s']:.2f}s  process {r['process_s']:.2f}s  "
+                f"max RSS {r['max_rss_mb']:.0f} MB  torch={'yes' if r['torch_loaded'] else 'no'}  "
+                f"modules={r['modules']}")
+        if r["warmup_s"] is not None:
+            line += f"  warmup {r['warmup_s']:.2f}s"
+        if args.serve:
+            line += f"  time-to-healthy {serve(entry):.2f}s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# margo-ml/bench/bench_constrained.py
+# Parse-success rate and tokens per usable recipe, free vs grammar-constrained
+# sampling, through ml_service.generate_texts (so MARGO_GEN_MODEL and the other
+# generation settings apply).
+#   python bench/bench_constrained.py [--requests 16] [--batch 4]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+import ml_service  # noqa: E402
+from bench_prefix_cache import sample_requests  # noqa: E402
+from prompts import build_prompt  # noqa: E402
+
+
+def run(prompts, batch: int, constrained: bool, seed: int):
+    ml_service.CONSTRAINED = constrained
+    before = ml_service._new_tokens.value
+    usable = 0
+    start = time.perf_counter()
+    for i in range(0, len(prompts), batch):
+        texts = ml_service.generate_texts(prompts[i:i + batch], seed=seed + i)
+        usable += sum(ml_service.parse_generated_text(t, "")['usable'] for t in texts)
+    secs = time.perf_counter() - start
+    return usable, ml_service._new_tokens.value - before, secs
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=16)
+    ap.add_argument("--batch", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    prompts = [build_prompt(r) for r in sample_requests(args.requests, random.Random(args.seed))]
+    ml_service.get_prefix_cache().warm()
+    print(f"model={ml_service.GEN_MODEL} requests={len(prompts)} batch={args.batch}")
+    for constrained in (False, True):
+        usable, tokens, secs = run(prompts, args.batch, constrained, args.seed)
+        per = f"{tokens / usable:.0f}" if usable else "inf"
+        print(f"{'constrained' if constrained else 'free':11}  parse success {usable}/{len(prompts)} "
+              f"({100 * usable / len(prompts):.0f}%)  tokens/usable recipe {per}  {secs:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# margo-ml/bench/bench_inference_pool.py
+# Generation throughput and latency through InferencePool for several replica
+# counts, threads per replica = cores // replicas.
+#   python bench/bench_inference_pool.py [--workers 1,2,4] [--requests 32] [--max-new-tokens 120]
+# MARGO_GEN_MODEL selects the generator as usual.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+import inference_pool  # noqa: E402
+import ml_service  # noqa: E402
+from bench_prefix_cache import sample_requests  # noqa: E402
+from prompts import build_prompt  # noqa: E402
+
+
+def load_generator():
+    gen = ml_service.get_generator()
+    return {"generator": gen.model, "tokenizer": gen.tokenizer, "embedder": None}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--requests", type=int, default=32)
+    ap.add_argument("--max-new-tokens", type=int, default=120)
+    args = ap.parse_args()
+
+    os.environ["MARGO_MAX_NEW_TOKENS"] = str(args.max_new_tokens)  # read by the spawned replicas
+    prompts = [build_prompt(r) for r in sample_requests(args.requests, random.Random(0))]
+    print(f"model={ml_service.GEN_MODEL} cores={len(inference_pool._cores())} requests={len(prompts)}")
+    base = None
+    for n in [int(w) for w in args.workers.split(",")]:
+        pool = inference_pool.InferencePool(load_generator, workers=n, queue_size=len(prompts))
+        pool.start()
+        pool.call("generate", prompts[:1], 0, 1)  # warm-up (prefix cache, allocator)
+
+        def one(i):
+            start = time.perf_counter()
+            pool.call("generate", [prompts[i]], i, 1)
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(prompts)) as ex:
+            lat = list(ex.map(one, range(len(prompts))))
+        rps = len(prompts) / (time.perf_counter() - start)
+        base = base or rps
+        print(f"replicas={n} threads={pool.threads}  {rps:6.2f} req/s ({rps / base:.2f}x)  "
+              f"p50={statistics.median(lat):7.0f} ms  p90={sorted(lat)[int(0.9 * (len(lat) - 1))]:7.0f} ms")
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# margo-ml/bench/bench_nutrition_client.py
+# Exercises NutritionClient against the local fake Edamam server: fan-out,
+# coalescing, caching and the hard time budget. Exits 1 if a check fails.
+#   python bench/bench_nutrition_client.py [--latency-ms 100] [--lines 48]
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+import fake_edamam  # noqa: E402
+from nutrition_client import TIMED_OUT, NutritionClient  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency-ms", type=float, default=100.0)
+    ap.add_argument("--lines", type=int, default=48)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    srv = fake_edamam.serve(0, latency_ms=args.latency_ms)
+    url = f"http://127.0.0.1:{srv.server_address[1]}/api/nutrition-data"
+    calls = lambda: fake_edamam.FakeEdamam.calls  # noqa: E731
+    failures = []
+
+    def check(name, ok, detail):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {detail}")
+        if not ok:
+            failures.append(name)
+
+    client = NutritionClient(url, "id", "key", budget_ms=60_000, concurrency=args.concurrency)
+    queries = [f"{i + 1} cup mystery grain {i}" for i in range(args.lines)]
+
+    start, before = time.perf_counter(), calls()
+    res = client.lookup_many(queries)
+    took = time.perf_counter() - start
+    serial = args.lines * args.latency_ms / 1000
+    check("fan-out", all(r == 100 for r in res) and took < serial / 2,
+          f"{args.lines} lines in {took:.2f}s (serial would be ~{serial:.2f}s), {calls() - before} upstream calls")
+
+    start, before = time.perf_counter(), calls()
+    client.lookup_many(queries)
+    check("cache", calls() == before, f"repeat batch in {1000 * (time.perf_counter() - start):.1f} ms, "
+                                      f"{calls() - before} upstream calls")
+
+    before = calls()
+    out, barrier = [], threading.Barrier(16)
+
+    def same():
+        barrier.wait()
+        out.append(client.lookup_many(["2 tbsp rare spice"])[0])
+
+    threads = [threading.Thread(target=same) for _ in range(16)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    check("coalescing", calls() - before == 1 and len(set(out)) == 1,
+          f"16 concurrent identical lookups -> {calls() - before} upstream call(s)")
+
+    slow_srv = fake_edamam.serve(0, latency_ms=2000)
+    slow = NutritionClient(f"http://127.0.0.1:{slow_srv.server_address[1]}/api/nutrition-data", "id", "key",
+                           budget_ms=200)
+    start = time.perf_counter()
+    res = slow.lookup_many(["1 cup slow thing"])
+    took = time.perf_counter() - start
+    check("budget", res[0] is TIMED_OUT and took < 0.4, f"2 s upstream, 200 ms budget -> returned in {took * 1000:.0f} ms")
+
+    srv.shutdown()
+    slow_srv.shutdown()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
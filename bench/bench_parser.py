@@ -0,0 +1,133 @@
+# margo-ml/bench/bench_parser.py
+# Parse throughput of recipe_parser vs the old three-scan parser, over a corpus
+# of generator outputs (a JSON list of strings), plus token-by-token feeding as
+# the stopping criterion does it, against the old rescan-per-token stop check.
+#   python bench/bench_parser.py [--corpus bench/generated_samples.json] [--repeat 2000]
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+from models import IngredientLine  # noqa: E402
+from recipe_parser import RecipeParser, parse_recipe_text  # noqa: E402
+
+
+def legacy_parse(gen_text: str, pantry_str: str):
+    # ml_service.parse_generated_text before the single-pass parser, minus the debug print
+    lines = gen_text.split('\n')
+    title = lines[0].strip() if lines else "Generated Recipe"
+    ingredients_start = next((i for i, line in enumerate(lines) if 'ingredients' in line.lower()), -1)
+    instructions_start = next((i for i, line in enumerate(lines) if 'instructions' in line.lower()), -1)
+    tips_start = next((i for i, line in enumerate(lines) if 'tips' in line.lower()), -1)
+    ingredients = []
+    if ingredients_start != -1:
+        end_idx = min(instructions_start, tips_start) if -1 not in (instructions_start, tips_start) else len(lines)
+        for line in lines[ingredients_start + 1:end_idx]:
+            if line.strip():
+                match = re.match(r'(\d*\.?\d+(?:/\d+)?|\w+)\s*(\w+)?\s*(.*)', line.strip())
+                if match:
+                    qty_str, unit, name = match.groups()
+                    try:
+                        qty = float(qty_str) if qty_str.replace('.', '', 1).isdigit() else {
+                            'half': 0.5, 'quarter': 0.25, 'one': 1.0
+                        }.get(qty_str.lower(), None) if '/' not in qty_str else eval(qty_str)
+                    except Exception:
+                        qty = None
+                    ingredients.append(IngredientLine(name=name.strip() or line.strip(), qty=qty, unit=unit))
+        if not ingredients:
+            ingredients = [IngredientLine(name=i.strip(), qty=1.0, unit="") for i in pantry_str.split(', ')]
+    instructions = '\n'.join(lines[instructions_start + 1: tips_start if tips_start != -1 else len(
+        lines)]) if instructions_start != -1 else "Follow standard steps."
+    tips = '\n'.join(lines[tips_start + 1:]) if tips_start != -1 else "Adjust spices to taste."
+    return {'title': title, 'ingredients': ingredients, 'instructions': instructions, 'tips': tips}
+
+
+def legacy_tips_complete(text: str, max_lines: int = 2) -> bool:
+    # decoding.tips_complete before RecipeParser: rescans the whole text per token
+    lines = text.split("\n")
+    header = next((i for i, line in enumerate(lines) if re.search("tips", line, re.IGNORECASE)), -1)
+    if header == -1:
+        return False
+    content = 0
+    for line in lines[header + 1:-1]:
+        if line.strip():
+            content += 1
+            if content >= max_lines:
+                return True
+        elif content:
+            return True
+    return False
+
+
+def legacy_stop(chunks):
+    text = ""
+    for c in chunks:
+        text += c
+        if legacy_tips_complete(text):
+            return
+
+
+def stream_stop(chunks):
+    p = RecipeParser(max_tips_lines=2)
+    for c in chunks:
+        if p.feed(c):
+            return
+
+
+def token_chunks(text: str):
+    # roughly BPE-sized pieces: a word with its leading space, or a newline
+    return re.findall(r"\n| ?[^\s]+|\s+", text)
+
+
+def timed(fn, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            fn(text)
+    return (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+
+def stream(chunks):
+    p = RecipeParser()
+    for c in chunks:
+        p.feed(c)
+    return p.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "generated_samples.json"))
+    ap.add_argument("--repeat", type=int, default=2000)
+    args = ap.parse_args()
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    pantry = "rice, onion"
+
+    legacy_us = timed(lambda t: legacy_parse(t, pantry), corpus, args.repeat)
+    single_us = timed(lambda t: parse_recipe_text(t, pantry), corpus, args.repeat)
+    tokenized = [token_chunks(t) for t in corpus]
+    stream_us = timed(stream, tokenized, args.repeat)
+    print(f"{len(corpus)} samples x {args.repeat}")
+    print(f"legacy three-scan parser : {legacy_us:8.1f} us/recipe")
+    print(f"single-pass parser       : {single_us:8.1f} us/recipe ({legacy_us / single_us:.2f}x)")
+    print(f"fed token by token       : {stream_us:8.1f} us/recipe")
+    # what RecipeStoppingCriteria pays per row over a whole generation
+    legacy_stop_us = timed(legacy_stop, tokenized, args.repeat)
+    stream_stop_us = timed(stream_stop, tokenized, args.repeat)
+    print(f"stop check, rescan/token : {legacy_stop_us:8.1f} us/recipe")
+    print(f"stop check, incremental  : {stream_stop_us:8.1f} us/recipe ({legacy_stop_us / stream_stop_us:.2f}x)")
+
+    print("\nper-sample (legacy title / ingredients -> new title / ingredients, confidence)")
+    for text in corpus:
+        old, new = legacy_parse(text, pantry), parse_recipe_text(text, pantry)
+        conf = " ".join(f"{k}={v:.2f}" for k, v in new['confidence'].items())
+        print(f"  {old['title'][:28]:28} {len(old['ingredients']):2d} -> "
+              f"{new['title'][:28]:28} {len(new['ingredients']):2d}  {conf}")
+
+
+if __name__ == "__main__":
+    main()
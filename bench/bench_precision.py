@@ -0,0 +1,98 @@
+# margo-ml/bench/bench_precision.py
+# Accuracy guard + latency/throughput report for MARGO_INFER_PRECISION modes.
+#   python bench/bench_precision.py [--modes fp32,bf16,int8-dynamic] [--max-drift 0.02]
+# Exits 1 if any mode's worst-case embedding cosine drift vs fp32 exceeds --max-drift.
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+from models import GenerateRequest  # noqa: E402
+from precision import PRECISIONS, apply_precision  # noqa: E402
+from prompts import build_prompt  # noqa: E402
+
+
+def recipe_texts():
+    with open(os.path.join(ROOT, "recipes.sample.json")) as f:
+        recipes = json.load(f)
+    out = []
+    for r in recipes:
+        names = " ".join(i.get("name") or "" for i in r.get("ingredients", []))
+        out.append(" | ".join(filter(None, [r.get("title"), names, r.get("instructions")])))
+    return out
+
+
+def bench_embedder(base: SentenceTransformer, mode: str, texts, ref):
+    model = apply_precision(copy.deepcopy(base), mode)
+    model.encode(texts[:8])  # warm-up
+    start = time.perf_counter()
+    emb = np.asarray(model.encode(texts, batch_size=32), dtype=np.float32)
+    secs = time.perf_counter() - start
+    cos = (emb * ref).sum(1) / (np.linalg.norm(emb, axis=1) * np.linalg.norm(ref, axis=1))
+    return {"texts_per_s": len(texts) / secs, "ms_per_text": 1000 * secs / len(texts),
+            "drift_mean": float(1 - cos.mean()), "drift_max": float(1 - cos.min())}
+
+
+def bench_generator(base, tok, mode: str, prompts, new_tokens: int):
+    model = apply_precision(copy.deepcopy(base), mode)
+    enc = tok(prompts, padding=True, return_tensors="pt")
+    kwargs = dict(max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False, pad_token_id=tok.eos_token_id)
+    with torch.no_grad():
+        model.generate(**tok(prompts[:1], return_tensors="pt"), max_new_tokens=4, pad_token_id=tok.eos_token_id)
+        start = time.perf_counter()
+        model.generate(**enc, **kwargs)
+    secs = time.perf_counter() - start
+    return {"latency_s": secs, "tokens_per_s": len(prompts) * new_tokens / secs}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--modes", default=",".join(PRECISIONS))
+    ap.add_argument("--max-drift", type=float, default=0.02)
+    ap.add_argument("--gen-model", default="gpt2-medium")
+    ap.add_argument("--new-tokens", type=int, default=64)
+    ap.add_argument("--batch", type=int, default=4)
+    ap.add_argument("--skip-generator", action="store_true")
+    args = ap.parse_args()
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    texts = recipe_texts()
+    emb_base = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+    ref = np.asarray(emb_base.encode(texts, batch_size=32), dtype=np.float32)
+
+    if not args.skip_generator:
+        tok = AutoTokenizer.from_pretrained(args.gen_model)
+        tok.pad_token_id = tok.eos_token_id
+        tok.padding_side = "left"
+        gen_base = AutoModelForCausalLM.from_pretrained(args.gen_model).eval()
+        prompts = [build_prompt(GenerateRequest(servings=s)) for s in (1, 2, 4, 6)][:args.batch]
+
+    print(f"threads={torch.get_num_threads()} texts={len(texts)}")
+    failed = []
+    for mode in modes:
+        e = bench_embedder(emb_base, mode, texts, ref)
+        line = (f"{mode:>13}  embed {e['texts_per_s']:7.1f} texts/s {e['ms_per_text']:6.2f} ms/text  "
+                f"drift mean={e['drift_mean']:.5f} max={e['drift_max']:.5f}")
+        if not args.skip_generator:
+            g = bench_generator(gen_base, tok, mode, prompts, args.new_tokens)
+            line += f"  |  generate {g['tokens_per_s']:6.1f} tok/s  batch latency {g['latency_s']:.2f}s"
+        print(line)
+        if e["drift_max"] > args.max_drift:
+            failed.append(mode)
+
+    if failed:
+        print(f"FAIL: embedding drift above {args.max_drift} for {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# margo-ml/bench/prefix_cache.py
+# Prefill time per request with and without the cached prompt prefix.
+#   python bench/bench_prefix_cache.py [--model gpt2-medium] [--requests 50] [--batch 1]
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from models import GenerateRequest  # noqa: E402
+from prefix_cache import PrefixKVCache  # noqa: E402
+from prompts import PROMPT_PREFIX, build_prompt  # noqa: E402
+
+def sample_requests(n: int, rng: random.Random):
+    diets = [[], ["vegan"], ["vegetarian"], ["gluten-free"]]
+    techs = [[], ["skillet"], ["sheet-pan", "one-pot"], ["stir-fry"]]
+    cuisines = [[], ["italian"], ["mexican"], ["asian", "fusion"]]
+    pantries = [[], ["rice", "eggs"], ["black beans", "tortillas", "onion"], ["pasta"]]
+    return [GenerateRequest(diet=rng.choice(diets), techniques=rng.choice(techs), cuisine=rng.choice(cuisines),
+                            pantry=rng.choice(pantries), servings=rng.choice([1, 2, 4, 6]),
+                            budgetCents=rng.choice([800, 1200, 2000]), minutes=rng.choice([20, 30, 45]))
+            for _ in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default="gpt2-medium")
+    ap.add_argument("--requests", type=int, default=50)
+    ap.add_argument("--batch", type=int, default=1)
+    args = ap.parse_args()
+
+    tok = AutoTokenizer.from_pretrained(args.model)
+    tok.pad_token_id = tok.eos_token_id
+    tok.padding_side = "left"
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+
+    cached = PrefixKVCache(model, tok, PROMPT_PREFIX, enabled=True)
+    plain = PrefixKVCache(model, tok, PROMPT_PREFIX, enabled=False)
+    cached.warm()
+    plain.warm()
+
+    prompts = [build_prompt(r) for r in sample_requests(args.requests, random.Random(0))]
+    batches = [prompts[i:i + args.batch] for i in range(0, len(prompts), args.batch)]
+
+    def prefill(cache: PrefixKVCache, batch):
+        ids, mask, past = cache.encode(batch)
+        start = time.perf_counter()
+        with torch.no_grad():
+            if past is None:
+                model(input_ids=ids, attention_mask=mask, use_cache=True)
+            else:
+                plen = past.get_seq_length()
+                pos = (mask.long().cumsum(-1) - 1).clamp(min=0)[:, plen:]
+                model(input_ids=ids[:, plen:], attention_mask=mask, position_ids=pos, past_key_values=past, use_cache=True)
+        return (time.perf_counter() - start) * 1000
+
+    prefill(plain, batches[0]); prefill(cached, batches[0])  # warm-up
+    full = [prefill(plain, b) / len(b) for b in batches]
+    reuse = [prefill(cached, b) / len(b) for b in batches]
+
+    print(f"model={args.model} threads={torch.get_num_threads()} requests={len(prompts)} batch={args.batch}")
+    print(f"prefix tokens: {cached._prefix_ids.shape[1]}  avg prompt tokens: "
+          f"{statistics.mean(len(tok(p).input_ids) for p in prompts):.1f}")
+    print(f"prefill ms/request  full: p50={statistics.median(full):.1f} mean={statistics.mean(full):.1f}")
+    print(f"prefill ms/request  cached prefix: p50={statistics.median(reuse):.1f} mean={statistics.mean(reuse):.1f}")
+    print(f"saved ms/request: {statistics.mean(full) - statistics.mean(reuse):.1f} "
+          f"({100 * (1 - statistics.mean(reuse) / statistics.mean(full)):.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
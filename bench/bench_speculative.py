@@ -0,0 +1,61 @@
+# margo-ml/bench/bench_speculative.py
+# End-to-end generate_ml_structured latency (generation, parse, embedding,
+# calories) with and without the draft model, on the production prompt template.
+#   python bench/bench_speculative.py [--draft distilgpt2] [--requests 10]
+# MARGO_GEN_MODEL selects the generator as usual.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+import metrics  # noqa: E402
+import ml_service  # noqa: E402
+import speculative  # noqa: E402
+from bench_prefix_cache import sample_requests  # noqa: E402
+
+
+def run(reqs, draft):
+    speculative.DRAFT_MODEL = draft
+    tokens_before = ml_service._new_tokens.value
+    lat = []
+    for i, req in enumerate(reqs):
+        req.seed = 1000 + i  # same sampling noise in both runs
+        start = time.perf_counter()
+        ml_service.generate_ml_structured(req)
+        lat.append((time.perf_counter() - start) * 1000)
+    tokens = ml_service._new_tokens.value - tokens_before
+    return lat, tokens / (sum(lat) / 1000)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--draft", default=speculative.DRAFT_MODEL or "distilgpt2")
+    ap.add_argument("--requests", type=int, default=10)
+    args = ap.parse_args()
+
+    reqs = sample_requests(args.requests, random.Random(0))
+    speculative.DRAFT_MODEL = args.draft
+    ml_service.warmup()  # loads generator, embedder and draft up front
+    ml_service.generate_ml_structured(reqs[0])  # warm-up
+
+    print(f"generator={ml_service.GEN_MODEL} draft={args.draft} requests={len(reqs)} "
+          f"max_new_tokens={ml_service.GEN_KWARGS['max_new_tokens']}")
+    for draft in (None, args.draft):
+        snap = metrics.snapshot()
+        lat, tps = run(reqs, draft)
+        line = (f"{'draft ' + draft if draft else 'no draft':24} p50={statistics.median(lat):8.0f} ms "
+                f"mean={statistics.mean(lat):8.0f} ms  {tps:6.1f} tokens/s")
+        if draft:
+            after = metrics.snapshot()
+            proposed = after["speculative.draft_tokens"] - snap["speculative.draft_tokens"]
+            accepted = after["speculative.accepted_tokens"] - snap["speculative.accepted_tokens"]
+            line += f"  acceptance={accepted / proposed if proposed else 0:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# margo-ml/bench/bench_store_recipes.py
+# Rows/sec persisting generated recipes: one session and commit per recipe
+# (store_recipe in a loop, as /bulk_ml used to) vs store_recipes' multi-row
+# INSERT in one transaction. Needs a Postgres with pgvector at
+# MARGO_DATABASE_URL; rows are written with source "bench" and deleted after.
+#   python bench/bench_store_recipes.py [--rows 100,1000] [--repeat 3]
+import argparse
+import os
+import random
+import sys
+import time
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import db_service  # noqa: E402
+from db_service import Recipe, Session, store_recipe, store_recipes  # noqa: E402
+from heuristic import generate_bulk  # noqa: E402
+from models import BulkRequest  # noqa: E402
+
+SOURCE = "bench"
+
+
+def sample_recipes(n: int, seed: int):
+    rng = random.Random(seed)
+    base = generate_bulk(BulkRequest(count=n, servingsOptions=[2, 4, 6], budgetCents=5000, seed=seed))
+    out = []
+    for i in range(n):
+        r = dict(base[i % len(base)])
+        r["embedding"] = [rng.uniform(-1, 1) for _ in range(384)]
+        out.append(r)
+    return out
+
+
+def one_by_one(recipes):
+    return [store_recipe(r, source=SOURCE, session_factory=Session) for r in recipes]
+
+
+def batched(recipes):
+    return store_recipes(recipes, source=SOURCE, session_factory=Session)
+
+
+def cleanup():
+    with Session() as session:
+        session.execute(sa.delete(Recipe).where(Recipe.source == SOURCE))
+        session.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="100,1000")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    db_service.get_engine()
+    print(f"database={db_service.DATABASE_URL.rsplit('@', 1)[-1]}")
+    try:
+        for n in [int(x) for x in args.rows.split(",")]:
+            recipes = sample_recipes(n, seed=n)
+            for name, fn in (("store_recipe per row", one_by_one), ("store_recipes bulk", batched)):
+                best = float("inf")
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    ids = fn(recipes)
+                    best = min(best, time.perf_counter() - start)
+                    assert len(ids) == n
+                    cleanup()
+                print(f"{n:6d} rows  {name:22}  {best * 1000:9.1f} ms  {n / best:9.0f} rows/s")
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# margo-ml/bench/fake_edamam.py
+# Local stand-in for Edamam's nutrition-data endpoint, for exercising the
+# remote nutrition path offline:
+#   python bench/fake_edamam.py --port 8765 [--latency-ms 200] [--fail-rate 0.1]
+#   EDAMAM_URL=http://127.0.0.1:8765/api/nutrition-data MARGO_NUTRITION_REMOTE=edamam ...
+# Answers from the local nutrient table, or a flat 100 kcal per unknown line.
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import nutrition  # noqa: E402
+
+_QTY_UNIT = re.compile(r"^\s*(\d+(?:\.\d+)?)\s+(\S+)?\s*(.*)$")
+
+
+class FakeEdamam(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    calls = 0
+    _calls_lock = threading.Lock()
+
+    def do_GET(self):
+        with FakeEdamam._calls_lock:
+            FakeEdamam.calls += 1
+        url = urlparse(self.path)
+        if url.path != "/api/nutrition-data":
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.send_error(503)
+            return
+        ingr = parse_qs(url.query).get("ingr", [""])[0]
+        m = _QTY_UNIT.match(ingr)
+        qty, unit, name = (float(m.group(1)), m.group(2) or "", m.group(3)) if m else (1.0, "", ingr)
+        # table lookup only: calories_for() could fall back to this very server
+        hit = nutrition.resolve(name or unit, unit if name else "")
+        kcal = round(float(nutrition._KCAL[hit[0]]) * hit[1] * qty) if hit else 100
+        body = json.dumps({"calories": kcal, "ingr": ingr}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = 0, latency_ms: float = 0.0, fail_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Starts the fake server on a background thread; port 0 picks a free one."""
+    FakeEdamam.latency = latency_ms / 1000.0
+    FakeEdamam.fail_rate = fail_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeEdamam)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    srv = serve(args.port, args.latency_ms, args.fail_rate)
+    print(f"fake Edamam on http://127.0.0.1:{srv.server_address[1]}/api/nutrition-data")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
@@ -0,0 +1,202 @@
+# margo-ml/catalog_index.py
+# The heuristic catalogs compiled once into arrays: diet/gluten bitmasks per
+# item and profile compatibility masks. Per set of constraints, the cost of
+# every (profile, protein, starch, veg) combination is computed in one
+# broadcast and reduced to the feasible combinations, which are cached, so a
+# request is one uniform draw from that set instead of a chain of filtered
+# random.choice calls.
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from catalogs import CAT_PROTEIN, CAT_STARCH, CAT_VEG, COMPAT, FLAVOR_PROFILES
+
+VEGAN, VEGETARIAN, GLUTEN_FREE = 1, 2, 4
+_DIET_BITS = {"vegan": VEGAN | VEGETARIAN, "vegetarian": VEGETARIAN, "gluten-free": GLUTEN_FREE}
+
+Combo = Tuple[Dict, Dict, Dict, Dict]  # profile, protein, starch (gluten-swapped if needed), veg
+
+
+class NoFeasibleRecipe(ValueError):
+    """No catalog combination satisfies the request's constraints."""
+
+
+def _norm(items: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(sorted({" ".join(str(i).lower().split()) for i in items if str(i).strip()}))
+
+
+def gluten_free(diet: Iterable[str]) -> bool:
+    return "gluten-free" in _norm(diet)
+
+
+def in_pantry(name: str, pantry: Iterable[str]) -> bool:
+    return _mentions(name, _norm(pantry))
+
+
+@lru_cache(maxsize=4096)
+def _phrase(words: str) -> re.Pattern:
+    # whole words only, allowing a plural: "egg" finds "eggs" but "oil" not "boiled"
+    return re.compile(rf"\b{re.escape(words)}(?:e?s)?\b")
+
+
+def _mentions(name: str, terms: Tuple[str, ...]) -> bool:
+    # "pork" matches "Pork loin", and pantry "long-grain rice" matches "Long-grain rice"
+    name = " ".join(name.lower().split())
+    return any(_phrase(t).search(name) or _phrase(name).search(t) for t in terms)
+
+
+_PAD = {"name": "", "sv": 0.0, "cents": 0}
+
+
+def _column(items: List[Dict], shape=None) -> Tuple[np.ndarray, np.ndarray]:
+    sv = np.array([it.get("sv", 0.5) for it in items], dtype=np.float64)
+    cents = np.array([it.get("cents", 0) for it in items], dtype=np.float64)
+    return (sv, cents) if shape is None else (sv.reshape(shape), cents.reshape(shape))
+
+
+def _qty(servings, sv: np.ndarray) -> np.ndarray:
+    # catalogs.qty_for over arrays; padding items (sv 0) stay 0
+    return np.where(sv > 0, np.round(np.maximum(1e-9, servings * sv), 2), 0.0)
+
+
+def _protein_bits(item: Dict) -> int:
+    bits = GLUTEN_FREE
+    if item.get("vegan"):
+        bits |= VEGAN | VEGETARIAN
+    elif item.get("vegetarian"):
+        bits |= VEGETARIAN
+    return bits
+
+
+def _starch_bits(item: Dict) -> int:
+    # plant-based; gluten-free as is, or via its gf_alt swap
+    return VEGAN | VEGETARIAN | (GLUTEN_FREE if "gf" in item or "gf_alt" in item else 0)
+
+
+class CatalogIndex:
+    def __init__(self, profiles=FLAVOR_PROFILES, proteins=CAT_PROTEIN, starches=CAT_STARCH, vegs=CAT_VEG,
+                 compat=COMPAT):
+        self.profiles, self.proteins, self.starches, self.vegs = profiles, proteins, starches, vegs
+        # the starch actually used under gluten-free
+        self.gf_starches = [s.get("gf_alt", s) if "gf" not in s else s for s in starches]
+        self.shape = (len(profiles), len(proteins), len(starches), len(vegs))
+
+        self.protein_bits = np.array([_protein_bits(p) for p in proteins], dtype=np.uint8)
+        self.starch_bits = np.array([_starch_bits(s) for s in starches], dtype=np.uint8)
+        # veg and flavour adds are all plant-based and gluten-free in the catalog
+        self.compat_starch = np.array([[compat.get(p["name"], {}).get("starch") is None
+                                        or s["name"] in compat[p["name"]]["starch"] for s in starches]
+                                       for p in profiles])
+        self.compat_veg = np.array([[compat.get(p["name"], {}).get("veg") is None
+                                     or v["name"] in compat[p["name"]]["veg"] for v in vegs] for p in profiles])
+        self._cuisine_words = [{p["name"].lower(), *p.get("cuisine", []), *p.get("tags", [])} for p in profiles]
+
+        # sv / cents columns for array math; flavour adds padded to the longest list
+        width = max(len(p["adds"]) for p in profiles)
+        self.adds = [p["adds"] + [_PAD] * (width - len(p["adds"])) for p in profiles]
+        self._columns = {
+            False: [_column(proteins), _column(starches), _column(vegs)],
+            True: [_column(proteins), _column(self.gf_starches), _column(vegs)],
+        }
+        self._adds_columns = _column([a for adds in self.adds for a in adds], (len(profiles), width))
+
+    def _owned(self, pantry: Tuple[str, ...], gf: bool) -> List[np.ndarray]:
+        # per axis: which items the pantry already covers (adds as (profiles, width))
+        axes = [self.proteins, self.gf_starches if gf else self.starches, self.vegs]
+        owned = [np.array([_mentions(it["name"], pantry) for it in items], dtype=bool) for items in axes]
+        owned.append(np.array([[a is not _PAD and _mentions(a["name"], pantry) for a in adds] for adds in self.adds]))
+        return owned
+
+    def quantities(self, combos: np.ndarray, servings: np.ndarray, gf: bool = False,
+                   pantry: Iterable[str] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        """For (N, 4) combination indices and N servings counts: an (N, 3 + adds)
+        matrix of qty_for values (protein, starch, veg, then the profile's adds)
+        and the N costs estimated_cost gives for the items not in the pantry."""
+        p, pr, s, v = np.asarray(combos).T
+
+        def gather(protein, starch, veg, adds):
+            return np.concatenate([protein[pr, None], starch[s, None], veg[v, None], adds[p]], 1)
+
+        cols = self._columns[gf] + [self._adds_columns]
+        sv, cents = gather(*[c[0] for c in cols]), gather(*[c[1] for c in cols])
+        owned = gather(*self._owned(_norm(pantry), gf))
+        qty = _qty(np.asarray(servings, dtype=np.float64)[:, None], sv)
+        return qty, (qty * cents * ~owned).sum(1).astype(np.int64)
+
+    @lru_cache(maxsize=1024)
+    def feasible(self, servings: int, budget_cents: int, diet: Tuple[str, ...], avoid: Tuple[str, ...],
+                 cuisine: Tuple[str, ...], pantry: Tuple[str, ...]) -> np.ndarray:
+        """Flat indices into `shape` of every combination the constraints allow
+        (arguments normalized by _norm). With a pantry, only the combinations
+        that use the most pantry items are kept."""
+        need = 0
+        for d in diet:
+            need |= _DIET_BITS.get(d, 0)
+        gf = bool(need & GLUTEN_FREE)
+        starches = self.gf_starches if gf else self.starches
+
+        def usable(items, bits=None):
+            ok = np.array([not _mentions(it["name"], avoid) for it in items], dtype=bool)
+            return ok if bits is None else ok & ((bits & need) == need)
+
+        profile_ok = np.array([not any(_mentions(a["name"], avoid) for a in p["adds"]) for p in self.profiles])
+        if cuisine:
+            profile_ok &= np.array([bool(words & set(cuisine)) for words in self._cuisine_words])
+        mask = (profile_ok[:, None, None, None]
+                & usable(self.proteins, self.protein_bits)[None, :, None, None]
+                & usable(starches, self.starch_bits)[None, None, :, None]
+                & usable(self.vegs)[None, None, None, :]
+                & self.compat_starch[:, None, :, None]
+                & self.compat_veg[:, None, None, :])
+
+        # what estimated_cost would charge, minus what the pantry covers
+        owned = self._owned(pantry, gf)
+        protein, starch, veg, adds = [_qty(servings, sv) * cents * ~own for (sv, cents), own
+                                      in zip(self._columns[gf] + [self._adds_columns], owned)]
+        cost = (adds.sum(1)[:, None, None, None] + protein[None, :, None, None]
+                + starch[None, None, :, None] + veg[None, None, None, :])
+        mask &= cost <= budget_cents
+
+        if pantry and mask.any():
+            hits = (owned[0].astype(np.int8)[None, :, None, None] + owned[1][None, None, :, None]
+                    + owned[2][None, None, None, :] + owned[3].sum(1)[:, None, None, None])
+            mask &= hits == hits[mask].max()
+        out = np.flatnonzero(mask)
+        out.flags.writeable = False  # shared by every request with these constraints
+        return out
+
+    def pool(self, servings: int, budget_cents: int, diet: Iterable[str], avoid: Iterable[str],
+             cuisine: Iterable[str], pantry: Iterable[str]) -> np.ndarray:
+        """feasible() for raw request fields; raises NoFeasibleRecipe when empty."""
+        pool = self.feasible(servings, budget_cents, _norm(diet), _norm(avoid), _norm(cuisine), _norm(pantry))
+        if not len(pool):
+            raise NoFeasibleRecipe(
+                f"no recipe fits {servings} servings within {budget_cents} cents for the given diet, "
+                "cuisine and avoid list")
+        return pool
+
+    def combo(self, flat: int, gf: bool = False) -> Combo:
+        p, pr, s, v = np.unravel_index(int(flat), self.shape)
+        return self.profiles[p], self.proteins[pr], (self.gf_starches if gf else self.starches)[s], self.vegs[v]
+
+    def sample(self, servings: int, budget_cents: int, diet: Iterable[str], avoid: Iterable[str],
+               cuisine: Iterable[str], pantry: Iterable[str], rng) -> Combo:
+        """A uniformly random feasible combination; raises NoFeasibleRecipe."""
+        pool = self.pool(servings, budget_cents, diet, avoid, cuisine, pantry)
+        return self.combo(pool[rng.randrange(len(pool))], gluten_free(diet))
+
+
+_index: Optional[CatalogIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> CatalogIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CatalogIndex()
+    return _index
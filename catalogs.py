@@ -1,5 +1,4 @@
 from typing import List, Dict
-import random
 from models import IngredientLine
 
 COMPAT = {
@@ -46,10 +45,6 @@ FLAVOR_PROFILES = [
     {"name": "Taco", "adds": [{"name": "Chili powder", "unit": "tsp", "sv": 1, "cents": 8}, {"name": "Cumin", "unit": "tsp", "sv": 1, "cents": 7}, {"name": "Lime", "unit": "", "sv": 0.5, "cents": 70}], "tags": ["mexican", "taco"], "techniques": ["skillet", "sheet-pan"], "cuisine": ["mexican"]},
 ]
 
-def pick_compatible(options, allowed_names):
-    pool = [o for o in options if o["name"] in allowed_names]
-    return random.choice(pool if pool else options)
-
 def title_from(profile, protein, starch, veg, technique):
     if starch["name"] == "Tortillas" or profile["name"] == "Taco":
         return f"{protein['name']} Tacos with {veg['name']}"
@@ -62,21 +57,6 @@ def title_from(profile, protein, starch, veg, technique):
 def qty_for(servings: int, item: Dict) -> float:
     return round(max(1e-9, servings * item.get("sv", 0.5)), 2)
 
-def respects_diet(item: Dict, diet: List[str]) -> bool:
-    if not diet: return True
-    if "vegan" in diet: return item.get("vegan") is True
-    if "vegetarian" in diet: return item.get("vegan") is True or item.get("vegetarian") is True
-    return True
-
-def gluten_swap(starch: Dict, diet: List[str]) -> Dict:
-    if "gluten-free" in diet and "gf" not in starch:
-        return starch.get("gf_alt", starch)
-    return starch
-
-def choose(lst: List[Dict], diet: List[str]) -> Dict:
-    pool = [x for x in lst if respects_diet(x, diet)]
-    return random.choice(pool if pool else lst)
-
 def estimated_cost(servings: int, items: List[Dict]) -> int:
     total = 0
     for it in items:
@@ -0,0 +1,266 @@
+# margo-ml/decoding.py
+# Hooks into transformers' generate() that know what a recipe looks like.
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Deque, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+import metrics
+from recipe_parser import RecipeParser
+from seeding import derive_seed
+
+EARLY_STOP = os.getenv("MARGO_EARLY_STOP", "1") != "0"
+TIPS_LINES = int(os.getenv("MARGO_TIPS_LINES", "2"))  # lines kept after the Tips: header
+CONSTRAINED = os.getenv("MARGO_CONSTRAINED_DECODING", "0") == "1"
+
+# (min, max) lines per section and max tokens per line under constrained
+# decoding; together they allow more than max_new_tokens, so each section also
+# gets a share of the tokens left (_RowGrammar._section_end)
+INGREDIENT_LINES = (2, 12)
+STEP_LINES = (3, 8)
+LINE_TOKENS = {"title": 24, "ingredients": 20, "instructions": 80, "tips": 60}
+_SECTIONS = ("title", "ingredients", "instructions", "tips")
+_HEADERS = {"ingredients": "Ingredients:\n", "instructions": "Instructions:\n", "tips": "Tips:\n"}
+_QTY_START = re.compile(r"^[0-9\u00bc-\u00be\u2153-\u215e]")
+
+
+class RecipeStoppingCriteria(StoppingCriteria):
+    """Stops each sequence of a batch as soon as its Tips section is complete.
+
+    `prompt_len` is the (left-padded) prompt width, so only generated tokens
+    are inspected. Each row's new tokens are decoded and fed to its own
+    RecipeParser, so every line is parsed once however long the row gets."""
+
+    def __init__(self, tokenizer, prompt_len: int, max_new_tokens: int, max_tips_lines: int = TIPS_LINES):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.max_new_tokens = max_new_tokens
+        self.max_tips_lines = max_tips_lines
+        self._parsers: List[RecipeParser] = []
+        self._seen: List[int] = []
+        self.stopped_at: List[Optional[int]] = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        rows, width = input_ids.shape
+        if not self._parsers:
+            self._parsers = [RecipeParser(self.max_tips_lines) for _ in range(rows)]
+            self._seen = [self.prompt_len] * rows
+            self.stopped_at = [None] * rows
+        done = []
+        for r in range(rows):
+            if self.stopped_at[r] is None:
+                chunk = self.tokenizer.decode(input_ids[r, self._seen[r]:], skip_special_tokens=True)
+                self._seen[r] = width
+                if self._parsers[r].feed(chunk):
+                    self.stopped_at[r] = width - self.prompt_len
+            done.append(self.stopped_at[r] is not None)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def tokens_saved(self) -> List[int]:
+        return [self.max_new_tokens - n if n is not None else 0 for n in self.stopped_at]
+
+    def report(self) -> None:
+        saved = metrics.histogram("generation.tokens_saved", [0, 25, 50, 100, 200, 300, 400, 500])
+        for n in self.tokens_saved():
+            saved.observe(n)
+        metrics.counter("generation.early_stopped").inc(sum(n is not None for n in self.stopped_at))
+
+
+@lru_cache(maxsize=4)
+def _vocab(tokenizer) -> Tuple[torch.Tensor, torch.Tensor, int]:
+    """(free-text mask, quantity-start ids, newline id) for a tokenizer. Free
+    text is every token without a newline in it; line breaks are only ever the
+    single "\n" token, so the grammar always knows where a line ends."""
+    size = len(tokenizer)
+    texts = tokenizer.batch_decode([[i] for i in range(size)])
+    free = torch.tensor(["\n" not in t for t in texts], dtype=torch.bool)
+    if tokenizer.eos_token_id is not None:
+        free[tokenizer.eos_token_id] = False
+    qty = torch.tensor([i for i, t in enumerate(texts) if _QTY_START.match(t)], dtype=torch.long)
+    return free, qty, tokenizer.encode("\n")[0]
+
+
+class _RowGrammar:
+    """Title line, Ingredients: with quantity-first lines, Instructions: with
+    numbered steps, Tips: with TIPS_LINES lines, then end of text. Header and
+    step-number tokens are forced; at each line start the model only chooses
+    between another line and the next header, within the section's bounds.
+
+    Every section is given an end position within `max_new_tokens`: its
+    minimum (header plus shortest required lines) plus a share of the spare
+    tokens, while the minimum of every later section stays reserved. Lines
+    are cut and the next header forced at that end, so Tips always fits."""
+
+    def __init__(self, tokenizer, tips_lines: int, max_new_tokens: int):
+        self.tok = tokenizer
+        self.tips_lines = tips_lines
+        self.max_new_tokens = max_new_tokens
+        self.section = "title"
+        self.items = 0  # finished lines in the current section
+        self.line = 0  # tokens on the current line
+        self.used = 0  # tokens generated so far
+        self.forced: Deque[int] = deque()
+        self._header = False  # forced tokens are a header (ending the line), not a step number
+        self._next_header: Optional[List[int]] = None
+        self._next_section: Optional[str] = None
+        self._step_len = max(len(self._ids(f"{i}.")) for i in range(1, STEP_LINES[1] + 1))
+        self._floor = 2  # tokens a line needs before it may end
+        self._end = self._section_end("title", 0)
+
+    def _ids(self, text: str) -> List[int]:
+        return self.tok.encode(text)
+
+    def _bounds(self, section: str) -> Tuple[int, int]:
+        return {"title": (1, 1), "ingredients": INGREDIENT_LINES, "instructions": STEP_LINES,
+                "tips": (self.tips_lines, self.tips_lines)}[section]
+
+    def _min_line(self, section: str) -> int:
+        # shortest line: two free tokens (after the step number) and the newline
+        return (self._step_len if section == "instructions" else 0) + 3
+
+    def _min_cost(self, section: str, header: Optional[int] = None) -> int:
+        header = len(self._ids(_HEADERS[section])) if header is None and section in _HEADERS else header or 0
+        return header + self._bounds(section)[0] * self._min_line(section)
+
+    def _section_end(self, section: str, header: int) -> int:
+        rest = _SECTIONS[_SECTIONS.index(section):]
+        mins = [self._min_cost(section, header)] + [self._min_cost(s) for s in rest[1:]]
+        weights = [self._bounds(s)[1] * LINE_TOKENS[s] for s in rest]
+        spare = max(0, self.max_new_tokens - self.used - sum(mins) - 1)  # 1: end of text
+        return self.used + mins[0] + spare * weights[0] // sum(weights)
+
+    def _required_after(self, lines: int) -> int:
+        # tokens the section's still-required lines need once `lines` are done
+        return max(0, self._bounds(self.section)[0] - lines) * self._min_line(self.section)
+
+    def _start_section(self, section: str, header: List[int]) -> None:
+        self.section, self.items, self.line = section, 0, 0
+        self.forced.extend(header)
+        self._header = bool(header)
+        self._floor = 2
+        self._end = self._section_end(section, len(header))
+
+    def advance(self, token: int, newline: int) -> None:
+        if self.section == "done":
+            return
+        self.used += 1
+        if self.forced:
+            self.forced.popleft()
+            # the header may end in a merged token such as ":\n"
+            self.line = 0 if self._header and not self.forced else self.line + 1
+            return
+        if token == newline:
+            if self.section == "title":
+                self._start_section("ingredients", self._ids("Ingredients:\n"))
+                return
+            self.items += 1
+            self.line = 0
+            if self.section == "tips" and self.items >= self.tips_lines:
+                self.section = "done"
+            return
+        if self.line == 0 and self._next_header and token == self._next_header[0]:
+            self._start_section(self._next_section, self._next_header[1:])
+            self._next_header = None
+            return
+        if self.line == 0 and self.section == "instructions":
+            number = self._ids(f"{self.items + 1}.")
+            self.forced.extend(number[1:])
+            self._header = False
+            self._floor = len(number) + 2  # no empty steps
+        self.line += 1
+
+    def allowed(self, free: torch.Tensor, qty: torch.Tensor, newline: int, eos: int):
+        """Either a list of permitted token ids, or a bool mask over the vocab."""
+        if self.section == "done":
+            return [eos]
+        if self.forced:
+            return [self.forced[0]]
+        left = self._end - self.used
+        if self.line >= self._floor and (self.line >= LINE_TOKENS[self.section]
+                                         or left <= 1 + self._required_after(self.items + 1)):
+            return [newline]
+        if self.line == 0 and self.section in ("ingredients", "instructions"):
+            lo, hi = self._bounds(self.section)
+            nxt = "instructions" if self.section == "ingredients" else "tips"
+            self._next_section, self._next_header = nxt, self._ids(_HEADERS[nxt])
+            header = [self._next_header[0]] if self.items >= lo else []
+            fits = left >= self._min_line(self.section) + self._required_after(self.items + 1)
+            if self.items >= hi or (header and not fits):
+                return header
+            if self.section == "ingredients":
+                return qty.tolist() + header
+            return self._ids(f"{self.items + 1}.")[:1] + header
+        mask = free.clone()
+        mask[newline] = self.line >= self._floor  # no empty or one-token lines
+        return mask
+
+
+class RecipeGrammarProcessor(LogitsProcessor):
+    """Constrains sampling to the recipe skeleton parse_recipe_text expects, so
+    every finished row parses into a usable recipe. One grammar state per row,
+    advanced by the token sampled at the previous step."""
+
+    def __init__(self, tokenizer, prompt_len: int, max_new_tokens: int, tips_lines: int = TIPS_LINES):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.max_new_tokens = max_new_tokens
+        self.tips_lines = tips_lines
+        self.free, self.qty, self.newline = _vocab(tokenizer)
+        self.eos = tokenizer.eos_token_id
+        self._rows: List[_RowGrammar] = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        rows, width = input_ids.shape
+        if not self._rows:
+            self._rows = [_RowGrammar(self.tokenizer, self.tips_lines, self.max_new_tokens) for _ in range(rows)]
+        vocab = scores.shape[-1]
+        if self.free.device != scores.device or self.free.shape[0] != vocab:
+            free = torch.zeros(vocab, dtype=torch.bool)
+            n = min(vocab, self.free.shape[0])
+            free[:n] = self.free[:n].cpu()
+            self.free, self.qty = free.to(scores.device), self.qty.to(scores.device)
+        out = torch.full_like(scores, float("-inf"))
+        for r, grammar in enumerate(self._rows):
+            if width > self.prompt_len:
+                grammar.advance(int(input_ids[r, -1]), self.newline)
+            allowed = grammar.allowed(self.free, self.qty, self.newline, self.eos)
+            if isinstance(allowed, list):
+                idx = torch.tensor(allowed, dtype=torch.long, device=scores.device)
+                out[r, idx] = scores[r, idx]
+            else:
+                out[r, allowed] = scores[r, allowed]
+        return out
+
+
+class SeededSampler(LogitsProcessor):
+    """Temperature / top-k sampling driven by one seed per row instead of the
+    global torch RNG, for use with do_sample=False (greedy then picks the
+    Gumbel-max sample). The noise for a row's k-th new token comes from a
+    generator seeded with (row seed, k), so a row generates the same text
+    whatever it is batched with, on whichever worker, and assisted decoding
+    re-verifying a position draws the same noise again."""
+
+    def __init__(self, seeds: List[int], prompt_len: int, temperature: float = 1.0, top_k: int = 50):
+        self.seeds = seeds
+        self.prompt_len = prompt_len
+        self.temperature = temperature
+        self.top_k = top_k
+        self._gen: Optional[torch.Generator] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        scores = scores.float() / self.temperature
+        if 0 < self.top_k < scores.shape[-1]:
+            kth = torch.topk(scores, self.top_k, dim=-1).values[:, -1:]
+            scores = scores.masked_fill(scores < kth, float("-inf"))
+        if self._gen is None:
+            self._gen = torch.Generator(device=scores.device)
+        step = input_ids.shape[1] - self.prompt_len
+        noise = torch.empty_like(scores)
+        for r, seed in enumerate(self.seeds):
+            self._gen.manual_seed(derive_seed(seed, step))
+            noise[r].uniform_(generator=self._gen)
+        return scores - torch.log(-torch.log(noise.clamp_(1e-20, 1.0 - 1e-7)))
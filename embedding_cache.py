@@ -0,0 +1,129 @@
+# margo-ml/embedding_cache.py
+# Embedding cache keyed by a hash of (model id, normalized text), with a bounded
+# in-memory LRU tier and an optional SQLite tier on disk.
+#   MARGO_EMBED_CACHE_SIZE  entries kept in memory (default 4096, 0 disables)
+#   MARGO_EMBED_CACHE_PATH  SQLite file for the disk tier (unset = memory only)
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import metrics
+
+EMBED_CACHE_SIZE = int(os.getenv("MARGO_EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_PATH = os.getenv("MARGO_EMBED_CACHE_PATH") or None
+
+EMBED_MODEL = os.getenv("MARGO_EMBED_MODEL", "all-MiniLM-L6-v2")
+# Vectors differ per precision mode, so the precision is part of the model id
+EMBED_MODEL_ID = f"{EMBED_MODEL}:{os.getenv('MARGO_INFER_PRECISION', 'fp32').lower()}"
+
+
+def normalize_text(text: str) -> str:
+    # MiniLM's tokenizer is uncased and ignores runs of whitespace, so this
+    # folds together texts that would embed identically anyway.
+    return " ".join(text.lower().split())
+
+
+def text_key(text: str, model_id: str) -> str:
+    return hashlib.sha1(f"{model_id}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def recipe_embedding_text(recipe: Dict) -> str:
+    # Text used to embed a stored recipe: title | ingredient names | instructions
+    title = recipe.get("title") or ""
+    ing_names = " ".join((i.get("name") or "") for i in recipe.get("ingredients", []) if isinstance(i, dict))
+    instr = recipe.get("instructions") or ""
+    return " | ".join(filter(None, [title, ing_names, instr]))
+
+
+class _DiskTier:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, array]:
+        out: Dict[str, array] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for k, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    out[k] = vec
+        return out
+
+    def put_many(self, items: Dict[str, array]) -> None:
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                                   [(k, v.tobytes()) for k, v in items.items()])
+            self._conn.commit()
+
+
+class EmbeddingCache:
+    """Vectors are held as float32 arrays (1.5 KB each for 384 dims) and
+    returned as plain lists, matching `encoder(...).tolist()`."""
+
+    def __init__(self, model_id: str, max_items: int = EMBED_CACHE_SIZE, path: Optional[str] = EMBED_CACHE_PATH):
+        self.model_id = model_id
+        self.max_items = max(0, max_items)
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, array]" = OrderedDict()
+        self._disk = _DiskTier(path) if path else None
+        self._hits_mem = metrics.counter("embed_cache.hits_memory")
+        self._hits_disk = metrics.counter("embed_cache.hits_disk")
+        self._misses = metrics.counter("embed_cache.misses")
+        metrics.gauge("embed_cache.memory_entries", lambda: len(self._mem))
+
+    def _remember(self, key: str, vec: array) -> None:
+        if not self.max_items:
+            return
+        with self._lock:
+            self._mem[key] = vec
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def encode(self, texts: Sequence[str], encoder: Callable[[List[str]], Sequence[Sequence[float]]]) -> List[List[float]]:
+        """Embeds `texts`, calling `encoder` once with only the distinct texts
+        that neither tier has seen."""
+        keys = [text_key(t, self.model_id) for t in texts]
+        found: Dict[str, array] = {}
+        with self._lock:
+            for k in keys:
+                vec = self._mem.get(k)
+                if vec is not None:
+                    self._mem.move_to_end(k)
+                    found[k] = vec
+        self._hits_mem.inc(sum(1 for k in keys if k in found))
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing and self._disk is not None:
+            from_disk = self._disk.get_many(missing)
+            self._hits_disk.inc(sum(1 for k in keys if k in from_disk))
+            for k, vec in from_disk.items():
+                self._remember(k, vec)
+            found.update(from_disk)
+            missing = [k for k in missing if k not in from_disk]
+
+        if missing:
+            first_text = {}
+            for k, t in zip(keys, texts):
+                first_text.setdefault(k, t)
+            computed = {k: array("f", v) for k, v in zip(missing, encoder([first_text[k] for k in missing]))}
+            self._misses.inc(len(computed))
+            for k, vec in computed.items():
+                self._remember(k, vec)
+            if self._disk is not None:
+                self._disk.put_many(computed)
+            found.update(computed)
+
+        return [found[k].tolist() for k in keys]
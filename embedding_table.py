@@ -0,0 +1,162 @@
+# margo-ml/embedding_table.py
+# Precomputed MiniLM embeddings for every recipe the heuristic generator can
+# produce, stored as a memory-mapped float16 matrix plus a JSON key index.
+# The embedding text depends only on (profile, protein, starch, veg, technique),
+# so servings/minutes/budget do not multiply the table.
+#
+# Build (or rebuild) offline:   python embedding_table.py [--out DIR]
+# The Docker image builds it at build time; MARGO_EMBED_TABLE_AUTOBUILD=1 makes
+# the full app rebuild it in the background when the catalogs change.
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import catalogs
+from catalogs import CAT_PROTEIN, CAT_STARCH, CAT_VEG, FLAVOR_PROFILES, title_from, write_instructions
+from embedding_cache import EMBED_MODEL_ID, recipe_embedding_text
+
+EMBED_TABLE_DIR = os.getenv("MARGO_EMBED_TABLE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_table"))
+TECHNIQUES = ["skillet", "sheet-pan", "one-pot", "stir-fry", "bake"]
+
+_VECTORS = "vectors.f16.npy"
+_INDEX = "index.json"
+
+
+def combo_key(profile: Dict, protein: Dict, starch: Dict, veg: Dict, technique: str) -> str:
+    return "|".join([profile["name"], protein["name"], starch["name"], veg["name"], technique])
+
+
+def catalog_fingerprint(model_id: str = EMBED_MODEL_ID) -> str:
+    # Anything that changes the embedded text (catalog data, title/instruction
+    # templates, the text builder) or the model invalidates the table.
+    h = hashlib.sha256()
+    h.update(model_id.encode())
+    h.update(inspect.getsource(catalogs).encode())
+    h.update(inspect.getsource(recipe_embedding_text).encode())
+    return h.hexdigest()
+
+
+def _starches() -> List[Dict]:
+    out = list(CAT_STARCH)
+    out.extend(s["gf_alt"] for s in CAT_STARCH if "gf_alt" in s)
+    return out
+
+
+def enumerate_combos() -> Iterator[Tuple[str, str]]:
+    """Yields (combo key, embedding text) for the full heuristic recipe space."""
+    for profile in FLAVOR_PROFILES:
+        for protein in CAT_PROTEIN:
+            for starch in _starches():
+                for veg in CAT_VEG:
+                    for technique in TECHNIQUES:
+                        recipe = {
+                            "title": title_from(profile, protein, starch, veg, technique),
+                            "ingredients": [{"name": it["name"]} for it in [protein, starch, veg] + profile["adds"]],
+                            # servings/minutes are not part of the instruction text
+                            "instructions": write_instructions(profile, technique, protein, starch, veg, 2, 30),
+                        }
+                        yield combo_key(profile, protein, starch, veg, technique), recipe_embedding_text(recipe)
+
+
+def build_table(encode: Callable[[List[str]], Sequence[Sequence[float]]], out_dir: str = EMBED_TABLE_DIR,
+                batch_size: int = 512) -> int:
+    combos = list(enumerate_combos())
+    keys = [k for k, _ in combos]
+    texts = [t for _, t in combos]
+    chunks = [np.asarray(encode(texts[i:i + batch_size]), dtype=np.float32) for i in range(0, len(texts), batch_size)]
+    vectors = np.concatenate(chunks).astype(np.float16)
+
+    os.makedirs(out_dir, exist_ok=True)
+    # unique temp names, so concurrent rebuilds (several workers or tasks on
+    # one volume) never write into each other's partial files
+    vec_fd, tmp_vec = tempfile.mkstemp(prefix=_VECTORS + ".", suffix=".tmp", dir=out_dir)
+    idx_fd, tmp_idx = tempfile.mkstemp(prefix=_INDEX + ".", suffix=".tmp", dir=out_dir)
+    try:
+        with os.fdopen(vec_fd, "wb") as f:
+            np.save(f, vectors)
+        with os.fdopen(idx_fd, "w") as f:
+            json.dump({"fingerprint": catalog_fingerprint(), "model": EMBED_MODEL_ID,
+                       "dim": int(vectors.shape[1]), "keys": keys}, f)
+        os.replace(tmp_vec, os.path.join(out_dir, _VECTORS))
+        os.replace(tmp_idx, os.path.join(out_dir, _INDEX))
+    finally:
+        for tmp in (tmp_vec, tmp_idx):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return len(keys)
+
+
+class EmbeddingTable:
+    def __init__(self, vectors: np.ndarray, keys: List[str]):
+        self.vectors = vectors
+        self.index = {k: i for i, k in enumerate(keys)}
+
+    @classmethod
+    def load(cls, path: str = EMBED_TABLE_DIR) -> Optional["EmbeddingTable"]:
+        # None when the table is missing or was built from other catalogs/model
+        try:
+            with open(os.path.join(path, _INDEX)) as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") != catalog_fingerprint():
+                return None
+            vectors = np.load(os.path.join(path, _VECTORS), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        return cls(vectors, meta["keys"])
+
+    def lookup(self, key: str) -> Optional[List[float]]:
+        i = self.index.get(key)
+        return None if i is None else self.vectors[i].astype(np.float32).tolist()
+
+
+_lock = threading.Lock()
+_table: Optional[EmbeddingTable] = None
+_loaded = False
+
+
+def get_table() -> Optional[EmbeddingTable]:
+    global _table, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                _table = EmbeddingTable.load()
+                _loaded = True
+    return _table
+
+
+def is_fresh(path: str = EMBED_TABLE_DIR) -> bool:
+    try:
+        with open(os.path.join(path, _INDEX)) as f:
+            return json.load(f).get("fingerprint") == catalog_fingerprint()
+    except (OSError, ValueError):
+        return False
+
+
+def rebuild(encode: Callable[[List[str]], Sequence[Sequence[float]]], path: str = EMBED_TABLE_DIR) -> int:
+    global _table, _loaded
+    n = build_table(encode, path)
+    with _lock:
+        _table = EmbeddingTable.load(path)
+        _loaded = True
+    return n
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="Build the heuristic recipe embedding table")
+    ap.add_argument("--out", default=EMBED_TABLE_DIR)
+    args = ap.parse_args()
+
+    from ml_service import get_embedder
+    embedder = get_embedder()
+    start = time.perf_counter()
+    n = build_table(lambda texts: embedder.encode(texts, batch_size=256), args.out)
+    print(f"embedded {n} combinations into {args.out} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,178 @@
+# margo-ml/heuristic.py
+# Catalog-driven recipe generator behind /generate. Imports nothing heavier
+# than the catalogs and the DB layer, so it can be served without torch.
+import random
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from models import GenerateRequest, BulkRequest, RecipeOut, IngredientLine
+from catalogs import title_from, qty_for, estimated_cost, write_instructions, COMPAT
+from catalog_index import NoFeasibleRecipe, get_index, gluten_free, in_pantry
+from write_behind import persist_recipe_async, persist_recipes_async
+from request_utils import user_uuid_from_headers
+from seeding import request_rng
+from embedding_table import combo_key, get_table
+
+def _table_embedding(profile, protein, starch, veg, technique):
+    table = get_table()
+    return table.lookup(combo_key(profile, protein, starch, veg, technique)) if table else None
+
+TIPS = "Use frozen veg if needed; adjust liquid for starch by ~1/4 cup."
+
+def _technique_options(profile: Dict, protein: Dict, preferred: Tuple[str, ...]) -> List[str]:
+    tech_pool = COMPAT.get(profile["name"], {}).get("tech") or {"skillet", "sheet-pan", "one-pot", "stir-fry", "bake"}
+    opts = sorted(tech_pool & set(preferred)) or sorted(tech_pool)
+    if protein["name"] == "Eggs":
+        opts = [t for t in opts if t != "stir-fry"] or ["bake", "one-pot", "skillet"]
+    return opts
+
+def _recipe(profile, protein, starch, veg, technique, servings, minutes, title, instructions, ingredients, cost) -> dict:
+    cook = min(35, minutes)
+    return {
+        "id": None,
+        "title": title,
+        "servings": servings,
+        "prepMinutes": max(5, int(0.35 * cook)),
+        "cookMinutes": cook,
+        "calories": None,
+        "imageUrl": None,
+        "tags": ["budget", "30-min", technique] + profile["tags"],
+        "instructions": instructions,
+        "tips": TIPS,
+        "ingredients": ingredients,
+        "estimatedCostCents": cost,
+        # precomputed when the embedding table is present; no model call needed
+        "embedding": _table_embedding(profile, protein, starch, veg, technique),
+    }
+
+def generate_structured(req: GenerateRequest, rng: Optional[random.Random] = None) -> dict:
+    # All choices come from `rng` (default: one seeded by req.seed), never the
+    # shared module-level generator, so concurrent requests stay independent.
+    # Raises NoFeasibleRecipe when diet, avoid, cuisine and budget rule out
+    # every combination.
+    rng = rng or request_rng(req.seed)
+    profile, protein, starch, veg = get_index().sample(
+        req.servings, req.budgetCents, req.diet, req.avoid, req.cuisine, req.pantry, rng)
+    technique = rng.choice(_technique_options(profile, protein, tuple(req.techniques)))
+
+    ingredients = []
+    for it in [protein, starch, veg] + profile["adds"]:
+        ingredients.append(IngredientLine(
+            name=it["name"],
+            qty=qty_for(req.servings, it),
+            unit=it.get("unit", ""),
+            form=None
+        ))
+
+    base_items = [protein, starch, veg] + profile["adds"]
+    # what still has to be bought; the index only offers combos within budget
+    cost = estimated_cost(req.servings, [it for it in base_items if not in_pantry(it["name"], req.pantry)])
+    instructions = write_instructions(profile, technique, protein, starch, veg, req.servings, req.minutes)
+    title = title_from(profile, protein, starch, veg, technique)
+    return _recipe(profile, protein, starch, veg, technique, req.servings, req.minutes, title, instructions,
+                   [i.model_dump() for i in ingredients], cost)
+
+@lru_cache(maxsize=32768)
+def _rendered(flat: int, gf: bool, technique: str) -> Tuple[str, str]:
+    # title and instructions depend only on the combination and technique
+    # (write_instructions ignores servings/minutes), so each renders once
+    profile, protein, starch, veg = get_index().combo(flat, gf)
+    return (title_from(profile, protein, starch, veg, technique),
+            write_instructions(profile, technique, protein, starch, veg, 2, 30))
+
+@lru_cache(maxsize=256)
+def _title_space(servings: int, budget_cents: int, diet: Tuple[str, ...], avoid: Tuple[str, ...],
+                 cuisine: Tuple[str, ...], pantry: Tuple[str, ...],
+                 techniques: Tuple[str, ...]) -> Tuple[Tuple[str, Tuple[Tuple[int, str], ...]], ...]:
+    # Distinct titles reachable under the constraints, each with the
+    # (combination, technique) pairs that render it (taco titles, for one,
+    # ignore the profile and starch).
+    index = get_index()
+    gf = gluten_free(diet)
+    by_title: Dict[str, List[Tuple[int, str]]] = {}
+    for flat in index.pool(servings, budget_cents, diet, avoid, cuisine, pantry).tolist():
+        profile, protein, _, _ = index.combo(flat, gf)
+        for technique in _technique_options(profile, protein, techniques):
+            by_title.setdefault(_rendered(flat, gf, technique)[0], []).append((flat, technique))
+    return tuple((title, tuple(variants)) for title, variants in by_title.items())
+
+def generate_bulk(req: BulkRequest, rng: Optional[random.Random] = None) -> List[dict]:
+    """Up to req.count recipes with pairwise distinct titles, drawn without
+    replacement from the feasible catalog space (fewer when the space is
+    smaller). Quantities and costs for the whole batch are computed as arrays."""
+    rng = rng or request_rng(req.seed)
+    index = get_index()
+    gf = gluten_free(req.diet)
+    sv_opts = req.servingsOptions if req.servingsOptions else ([req.servings] if req.servings else [4])
+    servings = [rng.choice(sv_opts) for _ in range(max(1, req.count))]
+
+    picks: List[Optional[Tuple[int, str]]] = [None] * len(servings)
+    used, errors = set(), []
+    for sv in sorted(set(servings)):
+        slots = [i for i, x in enumerate(servings) if x == sv]
+        try:
+            space = _title_space(sv, req.budgetCents, tuple(req.diet), tuple(req.avoid), tuple(req.cuisine),
+                                 tuple(req.pantry), tuple(req.techniques))
+        except NoFeasibleRecipe as e:
+            errors.append(e)
+            continue
+        space = [variants for title, variants in space if title not in used]
+        for i, variants in zip(slots, rng.sample(space, min(len(slots), len(space)))):
+            picks[i] = rng.choice(variants)
+            used.add(_rendered(picks[i][0], gf, picks[i][1])[0])
+    kept = [(sv, pick) for sv, pick in zip(servings, picks) if pick is not None]
+    if not kept:
+        raise errors[0] if errors else NoFeasibleRecipe("no feasible recipes")
+
+    flats = np.array([pick[0] for _, pick in kept])
+    sv_arr = np.array([sv for sv, _ in kept])
+    qty, cost = index.quantities(np.stack(np.unravel_index(flats, index.shape), 1), sv_arr, gf, req.pantry)
+    out = []
+    for row, ((sv, (flat, technique)), q, c) in enumerate(zip(kept, qty.tolist(), cost.tolist())):
+        profile, protein, starch, veg = index.combo(flat, gf)
+        title, instructions = _rendered(flat, gf, technique)
+        items = [protein, starch, veg] + profile["adds"]
+        ingredients = [{"name": it["name"], "qty": qv, "unit": it.get("unit", ""), "form": None}
+                       for it, qv in zip(items, q)]
+        out.append(_recipe(profile, protein, starch, veg, technique, sv, req.minutes, title, instructions,
+                           ingredients, c))
+    return out
+
+def make_router(embed: Optional[Callable[[List[dict]], None]] = None) -> APIRouter:
+    # `embed` fills recipe["embedding"] in place for each recipe missing one,
+    # in one batch; the torch-free entry point passes None
+    router = APIRouter()
+
+    # async handlers: sampling and embedding run on the threadpool (the first
+    # call loads the catalog index and embedding table), and the insert is
+    # awaited (asyncpg with MARGO_DB_ASYNC=1) instead of holding a worker thread
+    @router.post("/generate", response_model=RecipeOut)
+    async def generate(req: GenerateRequest, request: Request):
+        try:
+            recipe = await run_in_threadpool(generate_structured, req)
+        except NoFeasibleRecipe as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if embed is not None:
+            await run_in_threadpool(embed, [recipe])
+        user_id = user_uuid_from_headers(request)
+        recipe["id"] = await persist_recipe_async(recipe, user_id=user_id, source="heuristic")
+        return recipe
+
+    @router.post("/bulk")
+    async def bulk(req: BulkRequest, request: Request):
+        # heuristic counterpart of /bulk_ml: one sampling pass, one embed call
+        # for table misses, one commit (or one enqueue)
+        try:
+            recipes = await run_in_threadpool(generate_bulk, req)
+        except NoFeasibleRecipe as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if embed is not None:
+            await run_in_threadpool(embed, recipes)
+        ids = await persist_recipes_async(recipes, user_id=user_uuid_from_headers(request), source="heuristic")
+        for one, rid in zip(recipes, ids):
+            one["id"] = rid
+        return recipes
+
+    return router
@@ -0,0 +1,228 @@
+# margo-ml/inference_pool.py
+# Model replicas in worker processes, fronted by a router with a bounded queue.
+#   MARGO_INFER_WORKERS=0   replicas (0 = run models in the API process, as before)
+#   MARGO_INFER_THREADS=0   torch intra-op threads per replica (0 = cores // workers)
+#   MARGO_INFER_QUEUE=0     outstanding tasks across the pool (0 = 2 per worker)
+#   MARGO_INFER_QUEUE_TIMEOUT_MS=2000   how long an interactive call may wait for a slot
+# The parent loads the models once and moves their weights to shared memory;
+# workers are spawned with handles to the same storage, so N replicas cost one
+# copy of the weights (int8-dynamic packed weights are copied per worker).
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.multiprocessing as mp
+
+import metrics
+
+INFER_WORKERS = int(os.getenv("MARGO_INFER_WORKERS", "0"))
+INFER_THREADS = int(os.getenv("MARGO_INFER_THREADS", "0"))
+INFER_QUEUE = int(os.getenv("MARGO_INFER_QUEUE", "0"))
+INFER_QUEUE_TIMEOUT_MS = float(os.getenv("MARGO_INFER_QUEUE_TIMEOUT_MS", "2000"))
+
+
+class PoolBusy(Exception):
+    """No queue slot freed up within the caller's timeout."""
+
+
+def _cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def _worker_main(index: int, threads: int, cores: Optional[List[int]], models: dict, tasks, results) -> None:
+    # Runs in the spawned process: pin threads (and cores when there are enough
+    # to go around), adopt the shared models, then serve tasks until None.
+    if cores:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    import ml_service
+
+    ml_service._generator = SimpleNamespace(model=models["generator"], tokenizer=models["tokenizer"])
+    ml_service._embedder = models["embedder"]
+    ml_service._draft = models.get("draft")
+    ops: Dict[str, Callable] = {
+        "generate": ml_service.generate_texts,
+        "embed": lambda texts: ml_service.get_embedder().encode(texts, batch_size=32).tolist(),
+    }
+    results.put((None, index, True, None, None, None))  # ready
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, op, args = task
+        started = time.monotonic()  # CLOCK_MONOTONIC is shared by all processes
+        try:
+            out, ok = ops[op](*args), True
+        except Exception as e:  # reported to the caller's future
+            out, ok = f"{type(e).__name__}: {e}", False
+        results.put((task_id, index, ok, out, metrics.snapshot(), started))
+
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.tasks = None
+        self.outstanding: Dict[int, Future] = {}
+        self.queued_at: Dict[int, float] = {}
+        self.ready = threading.Event()
+        self.metrics: dict = {}
+
+
+class InferencePool:
+    """Routes each task to the replica with the fewest outstanding tasks.
+
+    At most `queue_size` tasks are outstanding (running or waiting) across the
+    pool; submit() waits up to `timeout` seconds for a slot and otherwise
+    raises PoolBusy, so interactive callers fail fast instead of queueing
+    behind bulk work."""
+
+    def __init__(self, load_models: Callable[[], dict], workers: int = INFER_WORKERS,
+                 threads: int = INFER_THREADS, queue_size: int = INFER_QUEUE):
+        self.workers = max(1, workers)
+        cores = _cores()
+        self.threads = threads or max(1, len(cores) // self.workers)
+        self.queue_size = queue_size or 2 * self.workers
+        self._load_models = load_models
+        self._ctx = mp.get_context("spawn")
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._models: Optional[dict] = None
+        self._results = None
+        self._closed = False
+        self._started = False  # until then start() reports dead workers itself
+        pin = len(cores) >= self.workers * self.threads
+        self._cores = [cores[i * self.threads:(i + 1) * self.threads] if pin else None for i in range(self.workers)]
+        self._workers = [_Worker(i) for i in range(self.workers)]
+
+        self._wait_ms = metrics.histogram("inference_pool.wait_ms")
+        self._run_ms = metrics.histogram("inference_pool.run_ms")
+        self._rejected = metrics.counter("inference_pool.rejected")
+        self._restarts = metrics.counter("inference_pool.restarts")
+        metrics.gauge("inference_pool.outstanding", lambda: sum(len(w.outstanding) for w in self._workers))
+        for w in self._workers:
+            metrics.gauge(f"inference_pool.worker{w.index}", lambda w=w: w.metrics)
+
+    def start(self) -> None:
+        models = self._load_models()
+        for m in models.values():
+            if isinstance(m, torch.nn.Module):
+                m.share_memory()
+        self._models = models
+        self._results = self._ctx.Queue()
+        for w in self._workers:
+            self._spawn(w)
+        threading.Thread(target=self._collect, name="margo-infer-router", daemon=True).start()
+        for w in self._workers:
+            while not w.ready.wait(1.0):
+                if not w.process.is_alive():
+                    raise RuntimeError(f"inference worker {w.index} exited during startup")
+        self._started = True
+
+    def _spawn(self, w: _Worker) -> None:
+        w.ready.clear()
+        w.tasks = self._ctx.Queue()
+        w.process = self._ctx.Process(
+            target=_worker_main, name=f"margo-infer-{w.index}", daemon=True,
+            args=(w.index, self.threads, self._cores[w.index], self._models, w.tasks, self._results))
+        w.process.start()
+
+    def submit(self, op: str, *args, timeout: Optional[float] = None) -> Future:
+        if not self._slots.acquire(timeout=timeout):
+            self._rejected.inc()
+            raise PoolBusy(f"{self.queue_size} inference tasks already outstanding")
+        fut: Future = Future()
+        fut.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            # replicas still (re)starting only get work when none is ready
+            w = min(self._workers, key=lambda x: (not x.ready.is_set(), len(x.outstanding), x.index))
+            task_id = next(self._ids)
+            w.outstanding[task_id] = fut
+            w.queued_at[task_id] = time.monotonic()
+            w.tasks.put((task_id, op, args))
+        return fut
+
+    def call(self, op: str, *args, timeout: Optional[float] = None):
+        return self.submit(op, *args, timeout=timeout).result()
+
+    def _collect(self) -> None:
+        while not self._closed:
+            self._reap()
+            try:
+                task_id, index, ok, out, snap, started = self._results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            w = self._workers[index]
+            if task_id is None:
+                w.ready.set()
+                continue
+            w.metrics = snap
+            with self._lock:
+                fut = w.outstanding.pop(task_id, None)
+                queued_at = w.queued_at.pop(task_id, started)
+            if fut is None:
+                continue
+            self._wait_ms.observe((started - queued_at) * 1000)
+            self._run_ms.observe((time.monotonic() - started) * 1000)
+            if ok:
+                fut.set_result(out)
+            else:
+                fut.set_exception(RuntimeError(out))
+
+    def _reap(self) -> None:
+        # A replica that died (e.g. OOM-killed), including one that died while
+        # restarting before it reported ready, fails its tasks and is replaced
+        if not self._started:
+            return
+        for w in self._workers:
+            if not w.process.is_alive() and not self._closed:
+                with self._lock:
+                    lost, w.outstanding, w.queued_at = w.outstanding, {}, {}
+                    self._spawn(w)
+                self._restarts.inc()
+                for fut in lost.values():
+                    fut.set_exception(RuntimeError(f"inference worker {w.index} exited"))
+
+    def close(self) -> None:
+        self._closed = True
+        for w in self._workers:
+            if w.tasks is not None:
+                w.tasks.put(None)
+        for w in self._workers:
+            if w.process is not None:
+                w.process.join(timeout=5)
+
+
+_pool: Optional[InferencePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(load_models: Callable[[], dict]) -> Optional[InferencePool]:
+    """The process-wide pool, started on first use; None when MARGO_INFER_WORKERS=0."""
+    global _pool
+    if INFER_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = InferencePool(load_models)
+                pool.start()
+                _pool = pool
+    return _pool
+
+
+def shutdown() -> None:
+    if _pool is not None:
+        _pool.close()
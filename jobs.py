@@ -0,0 +1,97 @@
+# margo-ml/jobs.py
+# Background bulk generation: jobs live in the `jobs` table, a bounded thread
+# pool works through them chunk by chunk, and every chunk commits its recipes
+# together with the job's progress so a restart resumes where it stopped.
+# Each process claims the jobs it runs (owner + heartbeat on the row); at
+# startup it claims the unowned ones and those whose owner has not stored a
+# chunk within MARGO_JOB_LEASE_S, so several workers never run the same job.
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Set
+
+import metrics
+from db_service import JobClaimLost, Session, claim_jobs, fetch_recipes, get_job, set_job_status, store_job_chunk
+from ml_service import expand_bulk_request, generate_ml_bulk
+from models import BulkRequest
+
+JOB_WORKERS = int(os.getenv("MARGO_JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.getenv("MARGO_JOB_CHUNK_SIZE", "8"))  # generation slots per commit
+# a claimed job whose heartbeat is older than this is taken over; keep it well
+# above the time one chunk takes to generate
+JOB_LEASE_S = float(os.getenv("MARGO_JOB_LEASE_S", "900"))
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS, chunk_size: int = JOB_CHUNK_SIZE, lease_s: float = JOB_LEASE_S,
+                 session_factory=Session):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_s = lease_s
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="margo-job")
+        self._chunk_size = max(1, chunk_size)
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._active: Set[str] = set()
+        self._done = metrics.counter("jobs.completed")
+        self._failed = metrics.counter("jobs.failed")
+        self._lost = metrics.counter("jobs.claim_lost")
+        metrics.gauge("jobs.active", lambda: len(self._active))
+
+    def submit(self, job_id: str) -> None:
+        # job_id must be claimed by self.owner: created with owner=self.owner or from claim_jobs
+        with self._lock:
+            if job_id in self._active:
+                return
+            self._active.add(job_id)
+        self._pool.submit(self._run, job_id)
+
+    def resume_pending(self) -> int:
+        ids = claim_jobs(self.owner, self._lease_s, session_factory=self._session_factory)
+        for job_id in ids:
+            self.submit(job_id)
+        return len(ids)
+
+    def _run(self, job_id: str) -> None:
+        try:
+            self._process(job_id)
+            self._done.inc()
+        except JobClaimLost as e:
+            # another process took the job over; it carries on from the stored progress
+            logging.getLogger(__name__).warning("job %s: stopping, %s", job_id, e)
+            self._lost.inc()
+        except Exception as e:
+            logging.getLogger(__name__).exception("job %s failed", job_id)
+            try:
+                set_job_status(job_id, "failed", error=str(e), owner=self.owner, session_factory=self._session_factory)
+            except JobClaimLost:
+                pass
+            self._failed.inc()
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _process(self, job_id: str) -> None:
+        job = get_job(job_id, session_factory=self._session_factory)
+        if job is None or job["status"] in ("done", "failed"):
+            return
+        req = BulkRequest(**job["request"])
+        # The servings plan and per-item seeds must be identical on resume, so
+        # derive them from the request seed or, failing that, from the job id.
+        reqs = expand_bulk_request(req, seed=req.seed if req.seed is not None else uuid.UUID(job_id).int)
+
+        set_job_status(job_id, "running", owner=self.owner, session_factory=self._session_factory)
+        seen_titles = {r["title"] for r in fetch_recipes(job["recipeIds"], session_factory=self._session_factory)}
+        attempted = job["attempted"]
+        while attempted < len(reqs):
+            chunk = reqs[attempted:attempted + self._chunk_size]
+            recipes = generate_ml_bulk(chunk, seen_titles=seen_titles)
+            store_job_chunk(job_id, recipes, attempted, attempted + len(chunk), owner=self.owner,
+                            session_factory=self._session_factory)
+            attempted += len(chunk)
+        set_job_status(job_id, "done", owner=self.owner, session_factory=self._session_factory)
+
+
+job_runner = JobRunner()
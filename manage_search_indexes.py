@@ -0,0 +1,60 @@
+# margo-ml/manage_search_indexes.py
+# Builds, rebuilds or drops the recipe indexes (db_service): the HNSW /
+# IVFFlat index on recipes.embedding, the GIN index on details -> 'tags' and
+# the indexes declared on the Recipe model, such as (source, source_id) for
+# seeded lookups. Everything is built CONCURRENTLY, so the API keeps writing
+# and searching while it runs. New databases get all of them when the recipes
+# table is created; the app never builds indexes on an existing table at
+# startup, so run this after upgrading or to change the build parameters.
+#
+#   python manage_search_indexes.py create [--kind hnsw|ivfflat] [--m 16] [--ef-construction 64]
+#                                          [--lists N] [--maintenance-work-mem 2GB] [--workers N]
+#   python manage_search_indexes.py drop
+#   python manage_search_indexes.py info
+# Defaults come from the MARGO_ANN_INDEX / MARGO_HNSW_* / MARGO_IVFFLAT_* settings;
+# set the same MARGO_ANN_INDEX for the API so searches use the matching knobs.
+import argparse
+import time
+
+import sqlalchemy as sa
+
+import db_service
+from db_service import (create_ann_index, drop_ann_index, maintenance_connection, search_index_info,
+                        table_index_ddl, tags_index_ddl)
+
+
+def _print_info():
+    info = search_index_info()
+    if not info:
+        print("no search indexes")
+    for name, idx in sorted(info.items()):
+        print(f"{name}: {idx['bytes'] / 2 ** 20:.1f}MiB\n  {idx['definition']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Manage the recipe search indexes")
+    ap.add_argument("action", choices=("create", "drop", "info"))
+    ap.add_argument("--kind", default=db_service.ANN_INDEX, choices=("hnsw", "ivfflat"))
+    ap.add_argument("--m", type=int, default=db_service.HNSW_M)
+    ap.add_argument("--ef-construction", type=int, default=db_service.HNSW_EF_CONSTRUCTION)
+    ap.add_argument("--lists", type=int, default=db_service.IVFFLAT_LISTS, help="0 = from the row count")
+    ap.add_argument("--maintenance-work-mem", default=None, help="e.g. 2GB; speeds up HNSW builds")
+    ap.add_argument("--workers", type=int, default=None, help="max_parallel_maintenance_workers")
+    args = ap.parse_args()
+
+    if args.action == "drop":
+        drop_ann_index()
+        print(f"dropped {db_service.ANN_INDEX_NAME}")
+    elif args.action == "create":
+        start = time.perf_counter()
+        with maintenance_connection() as conn:
+            for ddl in table_index_ddl(concurrently=True) + [tags_index_ddl(concurrently=True)]:
+                conn.execute(sa.text(ddl))
+        definition = create_ann_index(args.kind, m=args.m, ef_construction=args.ef_construction, lists=args.lists,
+                                      maintenance_work_mem=args.maintenance_work_mem, workers=args.workers)
+        print(f"built in {time.perf_counter() - start:.1f}s: {definition}")
+    _print_info()
+
+
+if __name__ == "__main__":
+    main()
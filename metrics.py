@@ -0,0 +1,103 @@
+# margo-ml/metrics.py
+# Tiny in-process metrics registry, exposed as JSON on GET /metrics.
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional
+
+_lock = threading.Lock()
+_registry: Dict[str, object] = {}
+
+DEFAULT_MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, n: float = 1) -> None:
+        with self._lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        self._fn = fn
+        self.value = 0
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+    def snapshot(self):
+        return self._fn() if self._fn else self.value
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self._lock = threading.Lock()
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, v: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, v)] += 1
+            self.count += 1
+            self.sum += v
+            self.max = max(self.max, v)
+
+    def quantile(self, q: float) -> Optional[float]:
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            labels = [str(b) for b in self.buckets] + ["+Inf"]
+            return {
+                "count": self.count,
+                "sum": round(self.sum, 3),
+                "max": round(self.max, 3),
+                "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+def _get_or_create(name: str, factory):
+    with _lock:
+        m = _registry.get(name)
+        if m is None:
+            m = _registry[name] = factory()
+        return m
+
+
+def counter(name: str) -> Counter:
+    return _get_or_create(name, Counter)
+
+
+def gauge(name: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+    return _get_or_create(name, lambda: Gauge(fn))
+
+
+def histogram(name: str, buckets: Optional[List[float]] = None) -> Histogram:
+    return _get_or_create(name, lambda: Histogram(buckets or DEFAULT_MS_BUCKETS))
+
+
+def snapshot() -> Dict[str, object]:
+    with _lock:
+        items = list(_registry.items())
+    return {name: m.snapshot() for name, m in sorted(items)}
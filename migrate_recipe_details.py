@@ -0,0 +1,99 @@
+# margo-ml/migrate_recipe_details.py
+# One-off backfill: removes the fields that now live only in their own columns
+# (embedding, id, title, instructions, ...; db_service.DETAILS_EXCLUDED) from
+# recipes.details, in keyset-paginated batches, one commit per batch.
+# Embeddings that only exist in details are moved into the embedding column.
+# Prints the table's heap / TOAST / index sizes before and after.
+#
+#   python migrate_recipe_details.py [--batch 1000] [--halfvec] [--vacuum-full]
+# --halfvec converts the embedding column to halfvec(384) first (pgvector
+#   >= 0.7; run with MARGO_EMBEDDING_HALFVEC=1 afterwards). Drop any vector
+#   index on the column beforehand, since its operator class is type-specific.
+# --vacuum-full rewrites the table so the freed space is returned to the OS
+#   (takes an exclusive lock); without it, VACUUM only makes it reusable.
+import argparse
+import time
+from typing import Dict
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, UUID as PG_UUID
+
+from db_service import DETAILS_EXCLUDED, EMBED_DIM, get_engine
+
+_SIZES = sa.text("""
+    SELECT pg_relation_size(c.oid) AS heap,
+           COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0) AS toast,
+           pg_indexes_size(c.oid) AS indexes,
+           pg_total_relation_size(c.oid) AS total
+    FROM pg_class c WHERE c.oid = 'recipes'::regclass
+""")
+
+
+def table_sizes(conn) -> Dict[str, int]:
+    return dict(conn.execute(_SIZES).mappings().one())
+
+
+def _fmt(sizes: Dict[str, int]) -> str:
+    return "  ".join(f"{k}={v / 2 ** 20:.1f}MiB" for k, v in sizes.items())
+
+
+def embedding_type(conn) -> str:
+    return conn.execute(sa.text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = 'recipes'::regclass AND attname = 'embedding'")).scalar()
+
+
+def backfill(engine, batch: int) -> int:
+    with engine.connect() as conn:
+        coltype = embedding_type(conn)
+    strip = " ".join(f"- '{key}'" for key in DETAILS_EXCLUDED)
+    update = sa.text(f"""
+        UPDATE recipes
+        SET details = details {strip},
+            embedding = COALESCE(embedding, CAST(details->>'embedding' AS {coltype}))
+        WHERE id = ANY(:ids) AND details ?| :keys
+    """).bindparams(sa.bindparam("ids", type_=ARRAY(PG_UUID(as_uuid=True))), sa.bindparam("keys", type_=ARRAY(sa.Text)))
+    page = sa.text("SELECT id FROM recipes WHERE id > :last ORDER BY id LIMIT :batch").bindparams(
+        sa.bindparam("last", type_=PG_UUID(as_uuid=True)))
+    first = sa.text("SELECT id FROM recipes ORDER BY id LIMIT :batch")
+    rewritten, last = 0, None
+    while True:
+        with engine.begin() as conn:  # one transaction per batch
+            ids = conn.execute(page if last is not None else first, {"last": last, "batch": batch}).scalars().all()
+            if not ids:
+                return rewritten
+            rewritten += conn.execute(update, {"ids": list(ids), "keys": list(DETAILS_EXCLUDED)}).rowcount
+        last = ids[-1]
+        print(f"  ... {rewritten} rows rewritten (last id {last})")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Strip column-backed fields from recipes.details")
+    ap.add_argument("--batch", type=int, default=1000)
+    ap.add_argument("--halfvec", action="store_true")
+    ap.add_argument("--vacuum-full", action="store_true")
+    args = ap.parse_args()
+
+    engine = get_engine()
+    with engine.connect() as conn:
+        before = table_sizes(conn)
+    print(f"before: {_fmt(before)}")
+
+    start = time.perf_counter()
+    if args.halfvec:
+        with engine.begin() as conn:
+            conn.execute(sa.text(f"ALTER TABLE recipes ALTER COLUMN embedding TYPE halfvec({EMBED_DIM}) "
+                                 f"USING embedding::halfvec({EMBED_DIM})"))
+        print(f"embedding column is now halfvec({EMBED_DIM})")
+    n = backfill(engine, args.batch)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(sa.text("VACUUM (FULL, ANALYZE) recipes" if args.vacuum_full else "VACUUM (ANALYZE) recipes"))
+        after = table_sizes(conn)
+    print(f"rewrote {n} rows in {time.perf_counter() - start:.1f}s")
+    print(f"after:  {_fmt(after)}")
+    saved = before["total"] - after["total"]
+    print(f"total size change: {-saved / 2 ** 20:+.1f}MiB ({-100 * saved / max(1, before['total']):+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,360 @@
+import hashlib
+import logging
+import os
+import threading
+import time
 import torch
-import requests
-import re
 from typing import List, Dict, Optional
 from sentence_transformers import SentenceTransformer
-from transformers import pipeline
-from models import IngredientLine, GenerateRequest, UserPreferences
+from transformers import pipeline, AutoModelForCausalLM, LogitsProcessorList, StoppingCriteriaList
+from models import IngredientLine, GenerateRequest, UserPreferences, BulkRequest
 from catalogs import estimated_cost
+from batching import GenerationBatcher
+import metrics
+from decoding import CONSTRAINED, EARLY_STOP, TIPS_LINES, RecipeGrammarProcessor, RecipeStoppingCriteria, SeededSampler
+from prefix_cache import PREFIX_CACHE, PrefixKVCache
+import speculative
+import inference_pool
+from prompts import PROMPT_PREFIX, build_prompt
+from precision import INFER_PRECISION, apply_precision
+from embedding_cache import EMBED_MODEL, EMBED_MODEL_ID, EmbeddingCache
+from nutrition import calories_for
+from recipe_parser import parse_recipe_text
+from seeding import derive_seed, fresh_seed, request_rng
 
 device = "cuda:0" if torch.cuda.is_available() else "cpu"
-generator = pipeline('text-generation', model='gpt2-medium', device=0 if torch.cuda.is_available() else -1)
-embedder = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+GEN_MODEL = os.getenv("MARGO_GEN_MODEL", "gpt2-medium")
+
+# Models load on first use (or via warmup()), not at import time
+_models_lock = threading.Lock()
+_generator = None
+_embedder = None
+_prefix_cache: Optional[PrefixKVCache] = None
+_draft = None
+
+
+def get_generator():
+    global _generator
+    if _generator is None:
+        with _models_lock:
+            if _generator is None:
+                gen = pipeline('text-generation', model=GEN_MODEL, device=0 if torch.cuda.is_available() else -1)
+                gen.model = apply_precision(gen.model, INFER_PRECISION, device)
+                # GPT-2 has no pad token; batched decoder-only generation needs left padding
+                gen.tokenizer.pad_token_id = gen.model.config.eos_token_id
+                gen.tokenizer.padding_side = "left"
+                gen.model.generation_config.pad_token_id = gen.model.config.eos_token_id
+                _generator = gen
+    return _generator
+
+
+def get_embedder() -> SentenceTransformer:
+    global _embedder
+    if _embedder is None:
+        with _models_lock:
+            if _embedder is None:
+                _embedder = apply_precision(SentenceTransformer(EMBED_MODEL, device=device), INFER_PRECISION, device)
+    return _embedder
+
+
+def get_prefix_cache() -> PrefixKVCache:
+    global _prefix_cache
+    if _prefix_cache is None:
+        gen = get_generator()
+        with _models_lock:
+            if _prefix_cache is None:
+                _prefix_cache = PrefixKVCache(gen.model, gen.tokenizer, PROMPT_PREFIX)
+    return _prefix_cache
+
+
+def get_draft_model():
+    # None unless MARGO_DRAFT_MODEL names a model that shares the generator's vocabulary
+    global _draft
+    if speculative.DRAFT_MODEL and _draft is None:
+        gen = get_generator()
+        with _models_lock:
+            if _draft is None:
+                draft = AutoModelForCausalLM.from_pretrained(speculative.DRAFT_MODEL)
+                draft = apply_precision(draft.to(device).eval(), INFER_PRECISION, device)
+                if not speculative.compatible(gen.model, draft):
+                    logging.getLogger(__name__).warning("Draft model %s does not share %s's vocabulary; disabled",
+                                                        speculative.DRAFT_MODEL, GEN_MODEL)
+                    speculative.DRAFT_MODEL = None
+                    return None
+                draft.generation_config.pad_token_id = gen.model.config.eos_token_id
+                draft.generation_config.num_assistant_tokens = speculative.DRAFT_TOKENS
+                _draft = draft
+    return _draft if speculative.DRAFT_MODEL else None
+
+
+_embed_cache: Optional[EmbeddingCache] = None
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    # Every MiniLM call goes through the shared content-hash cache
+    global _embed_cache
+    if _embed_cache is None:
+        with _models_lock:
+            if _embed_cache is None:
+                _embed_cache = EmbeddingCache(EMBED_MODEL_ID)
+    if not texts:
+        return []
+    return _embed_cache.encode(texts, _encode)
+
+
+def _pool_models() -> Dict:
+    # Loaded once in this process; the pool shares their weights with its replicas
+    gen = get_generator()
+    models = {"generator": gen.model, "tokenizer": gen.tokenizer, "embedder": get_embedder()}
+    draft = get_draft_model()
+    if draft is not None:
+        models["draft"] = draft
+    return models
+
+
+def _encode(texts: List[str]) -> List[List[float]]:
+    pool = inference_pool.get_pool(_pool_models)
+    if pool is not None:
+        return pool.call("embed", texts)
+    return get_embedder().encode(texts, batch_size=32).tolist()
+
+
+def warmup() -> None:
+    get_embedder()
+    get_prefix_cache().warm()
+    get_draft_model()
+    inference_pool.get_pool(_pool_models)
+
+
+GEN_KWARGS = dict(max_new_tokens=int(os.getenv("MARGO_MAX_NEW_TOKENS", "500")), do_sample=True, temperature=0.7)
+BULK_BATCH_SIZE = int(os.getenv("MARGO_BULK_BATCH_SIZE", "16"))  # rows per forward batch
+STREAM_BATCH_SIZE = int(os.getenv("MARGO_STREAM_BATCH_SIZE", "4"))  # rows per batch when streaming
+
+
+def generation_version() -> str:
+    # Everything besides the request that decides what a seed generates
+    parts = [GEN_MODEL, INFER_PRECISION, sorted(GEN_KWARGS.items()), "row-seeded", PROMPT_PREFIX, PREFIX_CACHE,
+             CONSTRAINED, EARLY_STOP and TIPS_LINES, speculative.DRAFT_MODEL]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+_parsed = metrics.counter("generation.parsed")
+_usable = metrics.counter("generation.usable")
+_new_tokens = metrics.counter("generation.new_tokens")
+metrics.gauge("generation.parse_success_rate", lambda: _usable.value / _parsed.value if _parsed.value else 0.0)
+metrics.gauge("generation.tokens_per_usable_recipe", lambda: _new_tokens.value / _usable.value if _usable.value else 0.0)
 
 
 def parse_generated_text(gen_text: str, pantry_str: str) -> Dict:
-    print(f"Raw LLM output: {gen_text}")  # Debug: Print full output
-    lines = gen_text.split('\n')
-    title = lines[0].strip() if lines else "Generated Recipe"
-    ingredients_start = next((i for i, line in enumerate(lines) if 'ingredients' in line.lower()), -1)
-    instructions_start = next((i for i, line in enumerate(lines) if 'instructions' in line.lower()), -1)
-    tips_start = next((i for i, line in enumerate(lines) if 'tips' in line.lower()), -1)
-
-    ingredients = []
-    # Parse ingredients with fallback for missing sections
-    if ingredients_start != -1:
-        start_idx = ingredients_start + 1
-        end_idx = min(instructions_start, tips_start) if -1 not in (instructions_start, tips_start) else len(lines)
-        for line in lines[start_idx:end_idx]:
-            if line.strip():
-                match = re.match(r'(\d*\.?\d+(?:/\d+)?|\w+)\s*(\w+)?\s*(.*)', line.strip())
-                if match:
-                    qty_str, unit, name = match.groups()
-                    try:
-                        qty = float(qty_str) if qty_str.replace('.', '', 1).isdigit() else {
-                            'half': 0.5,
-                            'quarter': 0.25,
-                            'one': 1.0
-                        }.get(qty_str.lower(), None) if '/' not in qty_str else eval(qty_str)
-                    except:
-                        qty = None
-                    ingredients.append(IngredientLine(name=name.strip() or line.strip(), qty=qty, unit=unit))
-        # Fallback to pantry items if no ingredients parsed
-        if not ingredients:
-            for item in pantry_str.split(', '):
-                ingredients.append(IngredientLine(name=item.strip(), qty=1.0, unit=""))
-
-    instructions = '\n'.join(lines[instructions_start + 1: tips_start if tips_start != -1 else len(
-        lines)]) if instructions_start != -1 else "Follow standard steps."
-    tips = '\n'.join(lines[tips_start + 1:]) if tips_start != -1 else "Adjust spices to taste."
-
-    return {'title': title, 'ingredients': ingredients, 'instructions': instructions, 'tips': tips}
+    # title / ingredients / instructions / tips, plus per-section confidence
+    parsed = parse_recipe_text(gen_text, pantry_str)
+    _parsed.inc()
+    _usable.inc(parsed['usable'])
+    return parsed
+
+
+def _row_seeds(rows: int, seed: Optional[int]) -> List[int]:
+    # A lone row uses the seed itself, so a bulk item and a /generate_ml call
+    # with that item's seed sample the same text.
+    if seed is None:
+        return [fresh_seed() for _ in range(rows)]
+    return [seed] if rows == 1 else [derive_seed(seed, i) for i in range(rows)]
+
+
+def generate_texts(prompts: List[str], seed: Optional[int] = None, n: int = 1,
+                   row_seeds: Optional[List[Optional[int]]] = None) -> List[str]:
+    # One padded forward batch. Returns n continuations per prompt (without the
+    # prompt itself), prompt-major, so len(result) == len(prompts) * n.
+    # Sampling noise comes from per-row seeds (`row_seeds`, else derived from
+    # `seed`), never the global torch RNG, so concurrent calls don't interact.
+    generator = get_generator()
+    input_ids, attention_mask, past = get_prefix_cache().encode(prompts, n)
+    rows, width = input_ids.shape
+    if row_seeds is None:
+        row_seeds = _row_seeds(rows, seed)
+    else:
+        row_seeds = [s if s is not None else fresh_seed() for s in row_seeds]
+    kwargs = dict(GEN_KWARGS)
+    stopper = None
+    if EARLY_STOP:
+        stopper = RecipeStoppingCriteria(generator.tokenizer, width, kwargs['max_new_tokens'])
+        kwargs['stopping_criteria'] = StoppingCriteriaList([stopper])
+    processors = []
+    if CONSTRAINED:
+        processors.append(RecipeGrammarProcessor(generator.tokenizer, width, kwargs['max_new_tokens']))
+    if kwargs.pop('do_sample', False):
+        processors.append(SeededSampler(row_seeds, width, kwargs.pop('temperature', 1.0), kwargs.pop('top_k', 50)))
+    kwargs['do_sample'] = False
+    if processors:
+        kwargs['logits_processor'] = LogitsProcessorList(processors)
+    # Assisted generation handles one row at a time and keeps its own caches, so
+    # it only replaces single-row calls (e.g. an unbatched /generate_ml); the
+    # per-row grammar state cannot follow its speculative rollbacks.
+    draft = get_draft_model() if input_ids.shape[0] == 1 and not CONSTRAINED else None
+    start = time.perf_counter()
+    with torch.no_grad():
+        if draft is None:
+            out = generator.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                           past_key_values=past, **kwargs)
+            n_new = int((out[:, width:] != generator.tokenizer.pad_token_id).sum())
+        else:
+            with speculative.measure(generator.model, draft) as spec:
+                out = generator.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                               assistant_model=draft, **kwargs)
+                spec["new_tokens"] = n_new = int((out[:, width:] != generator.tokenizer.pad_token_id).sum())
+    speculative.observe_throughput(n_new, time.perf_counter() - start)
+    if stopper is not None:
+        stopper.report()
+    _new_tokens.inc(n_new)
+    return [generator.tokenizer.decode(row[width:], skip_special_tokens=True).lstrip() for row in out]
+
+
+def run_generation(prompts: List[str], seed: Optional[int] = None, n: int = 1,
+                   timeout: Optional[float] = None, row_seeds: Optional[List[Optional[int]]] = None) -> List[str]:
+    # generate_texts on the least busy pool replica, or in this process when
+    # MARGO_INFER_WORKERS=0. `timeout` bounds the wait for a pool slot.
+    pool = inference_pool.get_pool(_pool_models)
+    if pool is None:
+        return generate_texts(prompts, seed, n, row_seeds)
+    return pool.call("generate", prompts, seed, n, row_seeds, timeout=timeout)
+
+
+# Interactive batches give up on a full pool (PoolBusy -> 503) instead of
+# queueing behind bulk work; one batcher thread per replica keeps them all busy.
+batcher = GenerationBatcher(
+    lambda prompts, seed: run_generation(prompts, seed, timeout=inference_pool.INFER_QUEUE_TIMEOUT_MS / 1000),
+    concurrency=max(1, inference_pool.INFER_WORKERS))
+
+
+def _pantry_str(req: GenerateRequest) -> str:
+    return ', '.join(req.pantry) or 'basic staples'
+
+
+def finish_recipes(reqs: List[GenerateRequest], parsed: List[Dict]) -> List[Dict]:
+    # All embeddings for the batch go through a single encode call
+    texts = [p['title'] + ' ' + p['instructions'] for p in parsed]
+    embeddings = embed_texts(texts)
+
+    calories_all = calories_for([p['ingredients'] for p in parsed])  # one vectorized pass for the batch
+
+    out = []
+    for req, p, embedding, calories in zip(reqs, parsed, embeddings, calories_all):
+        cost = estimated_cost(req.servings, [i.dict() for i in p['ingredients']]) if p['ingredients'] else 0
+        prep = max(5, req.minutes // 3)
+        cook = req.minutes - prep
+        out.append({
+            'id': None,
+            'title': p['title'],
+            'servings': req.servings,
+            'prepMinutes': prep,
+            'cookMinutes': cook,
+            'calories': calories,
+            'imageUrl': None,
+            'tags': req.techniques + req.diet + req.cuisine,
+            'instructions': p['instructions'],
+            'tips': p['tips'],
+            'ingredients': p['ingredients'],
+            'estimatedCostCents': cost,
+            'embedding': embedding
+        })
+    return out
+
+
+def finish_recipe(req: GenerateRequest, gen: str) -> Dict:
+    return finish_recipes([req], [parse_generated_text(gen, _pantry_str(req))])[0]
 
 
 def generate_ml_structured(req: GenerateRequest) -> Dict:
-    diet_str = ', '.join(req.diet) or 'any'
-    tech_str = ', '.join(req.techniques) or 'simple'
-    cuisine_str = ', '.join(req.cuisine) or 'varied'
-    pantry_str = ', '.join(req.pantry) or 'basic staples'
-    prompt = (
-        f"Create a unique {diet_str} recipe for {req.servings} servings. "
-        f"Use {tech_str} methods, {cuisine_str} style. Budget: under ${req.budgetCents / 100:.2f}. "
-        f"Time: {req.minutes} minutes total. Include pantry: {pantry_str}. "
-        "Format: Title on first line. Then 'Ingredients:' with at least 2-3 specific items (e.g., 2 cups rice, 1 lb tofu, 1/2 tsp salt). Then 'Instructions:' with 4-6 numbered steps. Then 'Tips:'."
-    )
-
-    gen = generator(prompt, max_new_tokens=500, num_return_sequences=1, temperature=0.7)[0]['generated_text']
-    parsed = parse_generated_text(gen, pantry_str)  # Pass pantry_str
-
-    recipe_text = parsed['title'] + ' ' + parsed['instructions']
-    embedding = embedder.encode(recipe_text, batch_size=32).tolist()
-
-    cost = estimated_cost(req.servings, [i.dict() for i in parsed['ingredients']]) if parsed['ingredients'] else 0
-    prep = max(5, req.minutes // 3)
-    cook = req.minutes - prep
-    calories = get_nutrition(parsed['ingredients']) if parsed['ingredients'] else None
-
-    return {
-        'id': None,
-        'title': parsed['title'],
-        'servings': req.servings,
-        'prepMinutes': prep,
-        'cookMinutes': cook,
-        'calories': calories,
-        'imageUrl': None,
-        'tags': req.techniques + req.diet + req.cuisine,
-        'instructions': parsed['instructions'],
-        'tips': parsed['tips'],
-        'ingredients': parsed['ingredients'],
-        'estimatedCostCents': cost,
-        'embedding': embedding
-    }
+    gen = batcher.generate(build_prompt(req), seed=req.seed)
+    return finish_recipe(req, gen)
+
+
+def _generation_chunks(reqs: List[GenerateRequest], batch_size: int, first_batch_size: Optional[int] = None):
+    """Yields [(request, generated text), ...] once per model invocation.
+
+    Requests that render the same prompt share a forward pass via
+    num_return_sequences; distinct prompts are packed into padded batches of up
+    to `batch_size` rows. The first invocation can be capped separately so a
+    streaming caller gets its first recipe after a single small generation."""
+    by_prompt: Dict[str, List[GenerateRequest]] = {}
+    for r in reqs:
+        by_prompt.setdefault(build_prompt(r), []).append(r)
+
+    pending = [(prompt, group) for prompt, group in by_prompt.items()]
+    rows = first_batch_size or batch_size
+    while pending:
+        # n sequences for each of up to rows // n prompts -> <= rows rows
+        pending.sort(key=lambda pg: len(pg[1]), reverse=True)
+        n = min(rows, len(pending[0][1]))
+        chunk = pending[:max(1, rows // n)]
+        # each request's own seed drives its row; short groups pad with None
+        row_seeds = [r.seed for _, group in chunk for r in group[:n] + [None] * (n - len(group[:n]))]
+        texts = run_generation([prompt for prompt, _ in chunk], n=n, row_seeds=row_seeds)
+        out, nxt = [], []
+        for i, (prompt, group) in enumerate(chunk):
+            take = group[:n]
+            out.extend(zip(take, texts[i * n:i * n + len(take)]))
+            if len(group) > n:
+                nxt.append((prompt, group[n:]))
+        pending = nxt + pending[len(chunk):]
+        rows = batch_size
+        yield out
+
+
+def _parse_unique(gens, seen_titles: set):
+    kept_reqs, kept_parsed = [], []
+    for r, text in gens:
+        p = parse_generated_text(text, _pantry_str(r))
+        if p['title'] in seen_titles:
+            continue
+        seen_titles.add(p['title'])
+        kept_reqs.append(r)
+        kept_parsed.append(p)
+    return kept_reqs, kept_parsed
+
+
+def expand_bulk_request(req: BulkRequest, seed: Optional[int] = None) -> List[GenerateRequest]:
+    # Servings are drawn from a generator seeded with `seed` (default req.seed),
+    # and item i gets seed derive_seed(seed, i): its recipe depends only on
+    # that, not on which batch or worker ends up generating it.
+    seed = req.seed if seed is None else seed
+    rng = request_rng(seed)
+    sv_opts = req.servingsOptions if req.servingsOptions else ([req.servings] if req.servings else [4])
+    return [GenerateRequest(
+        pantry=req.pantry,
+        budgetCents=req.budgetCents,
+        minutes=req.minutes,
+        servings=rng.choice(sv_opts),
+        diet=req.diet,
+        avoid=req.avoid,
+        techniques=req.techniques,
+        cuisine=req.cuisine,
+        seed=derive_seed(seed, i) if seed is not None else None,
+    ) for i in range(max(1, req.count))]
+
+
+def generate_ml_bulk(reqs: List[GenerateRequest], batch_size: int = BULK_BATCH_SIZE,
+                     seen_titles: Optional[set] = None) -> List[Dict]:
+    # Recipes whose title is already in `seen_titles` (or repeats within the
+    # batch) are dropped before embedding, so the result can be shorter than `reqs`.
+    gens = [g for chunk in _generation_chunks(reqs, batch_size) for g in chunk]
+    return finish_recipes(*_parse_unique(gens, seen_titles if seen_titles is not None else set()))
+
+
+def iter_ml_bulk(reqs: List[GenerateRequest], batch_size: int = STREAM_BATCH_SIZE):
+    # Streaming variant of generate_ml_bulk: yields finished recipes one model
+    # invocation at a time, so at most `batch_size` recipes are held at once.
+    seen_titles = set()
+    for chunk in _generation_chunks(reqs, batch_size, first_batch_size=1):
+        kept = _parse_unique(chunk, seen_titles)
+        if kept[0]:
+            yield finish_recipes(*kept)
 
 
 def get_nutrition(ingredients: List[IngredientLine]) -> Optional[int]:
     if not ingredients:
-        return None  # Avoid empty query
-    query = ' '.join(f"{i.qty or 1} {i.unit or ''} {i.name}" for i in ingredients)
-    print(f"QUERY: {query}")  # Debug query sent to Edamam
-    app_id = "02e8c544"
-    app_key = "08577906b34375ff41062ec9b8982f52"
-    resp = requests.get(f"https://api.edamam.com/api/nutrition-data?app_id={app_id}&app_key={app_key}&ingr={query}")
-    print(f"RESPONSE: {resp.json()}")  # Debug full response
-    return resp.json().get('calories', None) if resp.ok else None
+        return None
+    return calories_for([ingredients])[0]
 
 
 def get_user_embedding(prefs: UserPreferences) -> Dict:
@@ -115,5 +369,5 @@ def get_user_embedding(prefs: UserPreferences) -> Dict:
         prefs.primaryStore or '',
         ' '.join(f"{k}:{v}" for k, v in (prefs.extra or {}).items())
     ]))
-    embedding = embedder.encode(prefs_text, batch_size=32).tolist()
+    embedding = embed_texts([prefs_text])[0]
     return {"embedding": embedding}
\ No newline at end of file
@@ -47,6 +47,7 @@ class RecipeOut(BaseModel):
 
 class BulkRequest(BaseModel):
     count: int = 100
+    pantry: List[str] = []
     servings: Optional[int] = None
     servingsOptions: Optional[List[int]] = None
     minutes: int = 30
@@ -55,4 +56,30 @@ class BulkRequest(BaseModel):
     avoid: List[str] = []
     techniques: List[str] = []
     cuisine: List[str] = []
-    seed: Optional[int] = None
\ No newline at end of file
+    seed: Optional[int] = None
+
+class BulkJobOut(BaseModel):
+    id: str
+    status: str
+    count: int
+    attempted: int = 0
+    stored: int = 0
+    progress: float = 0.0
+    error: Optional[str] = None
+    createdAt: Optional[str] = None
+    updatedAt: Optional[str] = None
+    recipeIds: List[str] = Field(default_factory=list)
+    recipes: Optional[List[Dict]] = None
+
+class RecipeSearchRequest(BaseModel):
+    query: str
+    k: int = Field(10, ge=1, le=100)
+    source: Optional[str] = None
+    tags: List[str] = Field(default_factory=list)  # every tag must match
+
+class SimilarRecipeOut(BaseModel):
+    id: str
+    title: str
+    source: Optional[str] = None
+    tags: List[str] = Field(default_factory=list)
+    distance: float  # cosine distance, 0 = same direction
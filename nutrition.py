@@ -0,0 +1,165 @@
+# margo-ml/nutrition.py
+# Local calorie estimates for IngredientLine lists: a small nutrient table,
+# unit conversion, and one vectorized pass over every line of a batch.
+# Edamam is only consulted for lines the table cannot resolve, and only when
+# MARGO_NUTRITION_REMOTE=edamam and EDAMAM_APP_ID / EDAMAM_APP_KEY are set
+# (see nutrition_client.py).
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models import IngredientLine
+from nutrition_client import TIMED_OUT, NutritionClient
+
+NUTRITION_REMOTE = os.getenv("MARGO_NUTRITION_REMOTE", "off").lower()  # off | edamam
+EDAMAM_URL = os.getenv("EDAMAM_URL", "https://api.edamam.com/api/nutrition-data")
+EDAMAM_APP_ID = os.getenv("EDAMAM_APP_ID")
+EDAMAM_APP_KEY = os.getenv("EDAMAM_APP_KEY")
+if NUTRITION_REMOTE == "edamam" and not (EDAMAM_APP_ID and EDAMAM_APP_KEY):
+    logging.getLogger(__name__).warning(
+        "MARGO_NUTRITION_REMOTE=edamam but EDAMAM_APP_ID/EDAMAM_APP_KEY are not set; using local estimates only")
+    NUTRITION_REMOTE = "off"
+
+# name -> (unit, kcal per unit). Units are the catalog's units where possible.
+NUTRIENTS: Dict[str, Tuple[str, float]] = {
+    # proteins
+    "chicken breast": ("lb", 545), "chicken thigh": ("lb", 690), "chicken": ("lb", 600),
+    "ground turkey": ("lb", 680), "turkey": ("lb", 600), "ground beef": ("lb", 1150), "beef": ("lb", 1000),
+    "pork loin": ("lb", 640), "pork": ("lb", 800), "salmon": ("lb", 940), "shrimp": ("lb", 385),
+    "firm tofu": ("oz", 41), "tofu": ("oz", 36), "tempeh": ("oz", 54),
+    "chickpeas": ("can", 350), "black beans": ("can", 340), "kidney beans": ("can", 330), "lentils": ("cup", 680),
+    "eggs": ("ct", 72), "egg": ("ct", 72),
+    # starches
+    "long-grain rice": ("cup", 675), "rice": ("cup", 675), "brown rice": ("cup", 685),
+    "pasta": ("oz", 100), "gf pasta": ("oz", 100), "spaghetti": ("oz", 100), "noodles": ("oz", 100),
+    "potatoes": ("lb", 350), "potato": ("ct", 165), "sweet potato": ("ct", 115),
+    "quinoa": ("cup", 625), "couscous": ("cup", 650), "oats": ("cup", 300),
+    "tortillas": ("ct", 140), "corn tortillas": ("ct", 52), "bread": ("ct", 80),
+    # vegetables & fruit
+    "broccoli": ("cup", 31), "bell pepper": ("ct", 30), "onion": ("ct", 44), "zucchini": ("ct", 33),
+    "spinach": ("cup", 7), "carrot": ("ct", 25), "tomato": ("ct", 22), "crushed tomatoes": ("cup", 80),
+    "mushrooms": ("cup", 15), "garlic": ("clove", 4), "ginger": ("tsp", 2),
+    "lemon": ("ct", 17), "lime": ("ct", 20), "avocado": ("ct", 240),
+    # pantry & seasonings
+    "soy sauce": ("tbsp", 9), "brown sugar": ("tbsp", 52), "sugar": ("tbsp", 48), "honey": ("tbsp", 64),
+    "olive oil": ("tbsp", 119), "oil": ("tbsp", 120), "butter": ("tbsp", 102),
+    "flour": ("cup", 455), "milk": ("cup", 103), "cheese": ("oz", 110), "parmesan": ("tbsp", 22),
+    "coconut milk": ("cup", 445), "broth": ("cup", 15), "stock": ("cup", 15),
+    "parsley": ("tbsp", 1), "basil": ("tbsp", 1), "cilantro": ("tbsp", 0.2),
+    "cajun seasoning": ("tsp", 5), "paprika": ("tsp", 6), "chili powder": ("tsp", 8), "cumin": ("tsp", 8),
+    "salt": ("tsp", 0), "pepper": ("tsp", 6),
+}
+
+# unit -> (dimension, size in the dimension's base unit: ml, g or count)
+UNITS: Dict[str, Tuple[str, float]] = {
+    "ml": ("vol", 1.0), "l": ("vol", 1000.0), "tsp": ("vol", 4.929), "tbsp": ("vol", 14.787),
+    "cup": ("vol", 236.6), "floz": ("vol", 29.57),
+    "g": ("mass", 1.0), "kg": ("mass", 1000.0), "oz": ("mass", 28.35), "lb": ("mass", 453.6),
+    "ct": ("count", 1.0), "can": ("can", 1.0), "clove": ("clove", 1.0),
+}
+_UNIT_ALIASES = {
+    "": "ct", "each": "ct", "whole": "ct", "piece": "ct", "pieces": "ct", "large": "ct", "medium": "ct", "small": "ct",
+    "teaspoon": "tsp", "teaspoons": "tsp", "t": "tsp", "tsps": "tsp",
+    "tablespoon": "tbsp", "tablespoons": "tbsp", "tbs": "tbsp", "tbsps": "tbsp",
+    "cups": "cup", "c": "cup", "milliliter": "ml", "milliliters": "ml", "liter": "l", "liters": "l",
+    "gram": "g", "grams": "g", "kilogram": "kg", "kilograms": "kg",
+    "ounce": "oz", "ounces": "oz", "pound": "lb", "pounds": "lb", "lbs": "lb",
+    "cans": "can", "cloves": "clove", "fl oz": "floz",
+}
+_WORD = re.compile(r"[a-z]+(?:[- ][a-z]+)*")
+_NAMES_BY_LENGTH = sorted(NUTRIENTS, key=len, reverse=True)
+_ROW = {name: i for i, name in enumerate(NUTRIENTS)}
+_KCAL = np.array([NUTRIENTS[n][1] for n in NUTRIENTS], dtype=np.float64)
+
+
+def normalize_unit(unit: Optional[str]) -> Optional[str]:
+    u = (unit or "").strip().lower().rstrip(".")
+    u = _UNIT_ALIASES.get(u, u)
+    return u if u in UNITS else None
+
+
+def unit_factor(from_unit: Optional[str], to_unit: str) -> Optional[float]:
+    """How many `to_unit` one `from_unit` is, or None across dimensions."""
+    src = normalize_unit(from_unit)
+    if src is None:
+        return None
+    (dim_a, size_a), (dim_b, size_b) = UNITS[src], UNITS[to_unit]
+    return size_a / size_b if dim_a == dim_b else None
+
+
+def _lookup_name(name: str) -> Optional[str]:
+    n = " ".join(_WORD.findall(name.lower()))
+    if n in NUTRIENTS:
+        return n
+    if n.endswith("s") and n[:-1] in NUTRIENTS:
+        return n[:-1]
+    # longest table entry contained in the line ("boneless chicken breasts" -> chicken breast)
+    singular = " ".join(w[:-1] if w.endswith("s") and not w.endswith("ss") else w for w in n.split())
+    padded = f" {n} {singular} "
+    return next((k for k in _NAMES_BY_LENGTH if f" {k} " in padded), None)
+
+
+@lru_cache(maxsize=4096)
+def resolve(name: str, unit: Optional[str]) -> Optional[Tuple[int, float]]:
+    """(table row, table units per one line unit) or None if unknown."""
+    key = _lookup_name(name)
+    if key is None:
+        return None
+    factor = unit_factor(unit, NUTRIENTS[key][0])
+    return None if factor is None else (_ROW[key], factor)
+
+
+def calories_for(recipes: Sequence[Sequence[IngredientLine]]) -> List[Optional[int]]:
+    """Total kcal per ingredient list, for a whole batch in one vectorized pass.
+    A recipe gets None only if none of its lines could be estimated."""
+    rows, factors, owners = [], [], []
+    unresolved: List[Tuple[int, IngredientLine]] = []
+    for r, lines in enumerate(recipes):
+        for line in lines:
+            hit = resolve(line.name, line.unit)
+            if hit is None:
+                unresolved.append((r, line))
+                continue
+            rows.append(hit[0])
+            factors.append(hit[1] * (line.qty if line.qty is not None else 1.0))
+            owners.append(r)
+
+    n = len(recipes)
+    totals = np.bincount(np.asarray(owners, dtype=np.int64),
+                         weights=_KCAL[np.asarray(rows, dtype=np.int64)] * np.asarray(factors, dtype=np.float64),
+                         minlength=n) if owners else np.zeros(n)
+    covered = np.bincount(np.asarray(owners, dtype=np.int64), minlength=n) if owners else np.zeros(n, dtype=np.int64)
+
+    missing = np.zeros(n, dtype=bool)
+    if unresolved and NUTRITION_REMOTE == "edamam":
+        answers = get_client().lookup_many([line_query(l) for _, l in unresolved])
+        for (r, _), kcal in zip(unresolved, answers):
+            if kcal is TIMED_OUT:
+                missing[r] = True  # over budget: report None rather than a partial total
+            elif kcal is not None:
+                totals[r] += kcal
+                covered[r] += 1
+
+    return [int(round(totals[i])) if covered[i] and not missing[i] else None for i in range(n)]
+
+
+def line_query(line: IngredientLine) -> str:
+    return " ".join(filter(None, [f"{line.qty if line.qty is not None else 1:g}", line.unit or "", line.name])).strip()
+
+
+_client: Optional[NutritionClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> NutritionClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = NutritionClient(EDAMAM_URL, EDAMAM_APP_ID, EDAMAM_APP_KEY)
+    return _client
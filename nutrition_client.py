@@ -0,0 +1,120 @@
+# margo-ml/nutrition_client.py
+# Remote nutrition lookups (Edamam nutrition-data, one ingredient line per
+# request) with a pooled keep-alive session, a TTL cache per line, coalescing
+# of identical in-flight queries, concurrent fan-out, and a hard time budget.
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+NUTRITION_BUDGET_MS = float(os.getenv("MARGO_NUTRITION_BUDGET_MS", "800"))
+NUTRITION_TTL_S = float(os.getenv("MARGO_NUTRITION_TTL_S", "86400"))
+NUTRITION_CONCURRENCY = int(os.getenv("MARGO_NUTRITION_CONCURRENCY", "8"))
+NUTRITION_CACHE_SIZE = int(os.getenv("MARGO_NUTRITION_CACHE_SIZE", "20000"))
+NUTRITION_HTTP_TIMEOUT_S = float(os.getenv("MARGO_NUTRITION_HTTP_TIMEOUT_S", "5"))
+
+TIMED_OUT = object()  # lookup_many() marker for lines still pending at the deadline
+
+
+class NutritionClient:
+    def __init__(self, url: str, app_id: str, app_key: str, budget_ms: float = NUTRITION_BUDGET_MS,
+                 ttl_s: float = NUTRITION_TTL_S, concurrency: int = NUTRITION_CONCURRENCY,
+                 max_entries: int = NUTRITION_CACHE_SIZE, http_timeout_s: float = NUTRITION_HTTP_TIMEOUT_S):
+        self.url = url
+        self._auth = {"app_id": app_id, "app_key": app_key}
+        self.budget = budget_ms / 1000.0
+        self.ttl = ttl_s
+        self.max_entries = max_entries
+        self.http_timeout = http_timeout_s
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, concurrency), max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="margo-nutrition")
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # query -> (expires_at, kcal)
+        self._inflight: Dict[str, Future] = {}
+
+        self._hits = metrics.counter("nutrition.remote.cache_hits")
+        self._coalesced = metrics.counter("nutrition.remote.coalesced")
+        self._requests = metrics.counter("nutrition.remote.requests")
+        self._errors = metrics.counter("nutrition.remote.errors")
+        self._timeouts = metrics.counter("nutrition.remote.budget_timeouts")
+        self._latency = metrics.histogram("nutrition.remote.latency_ms")
+
+    def _cached(self, query: str):
+        entry = self._cache.get(query)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._cache[query]
+            return None
+        self._cache.move_to_end(query)
+        return entry
+
+    def _store(self, query: str, kcal: Optional[float]) -> None:
+        with self._lock:
+            self._cache[query] = (time.monotonic() + self.ttl, kcal)
+            self._cache.move_to_end(query)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _fetch(self, query: str) -> Optional[float]:
+        self._requests.inc()
+        start = time.monotonic()
+        try:
+            resp = self._session.get(self.url, params={**self._auth, "ingr": query}, timeout=self.http_timeout)
+            if resp.ok:
+                kcal = resp.json().get("calories")
+                self._store(query, kcal)  # only definitive answers are cached
+                return kcal
+            self._errors.inc()
+            return None
+        except (requests.RequestException, ValueError):
+            self._errors.inc()
+            return None
+        finally:
+            self._latency.observe((time.monotonic() - start) * 1000)
+            with self._lock:
+                self._inflight.pop(query, None)
+
+    def submit(self, query: str) -> Future:
+        """Future for one line; identical queries share a cache entry or one request."""
+        with self._lock:
+            entry = self._cached(query)
+            if entry is not None:
+                self._hits.inc()
+                f: Future = Future()
+                f.set_result(entry[1])
+                return f
+            f = self._inflight.get(query)
+            if f is not None:
+                self._coalesced.inc()
+                return f
+            f = self._inflight[query] = self._pool.submit(self._fetch, query)
+            return f
+
+    def lookup_many(self, queries: Sequence[str], budget: Optional[float] = None) -> List[object]:
+        """kcal (or None) per query; TIMED_OUT for queries that did not finish
+        within `budget` seconds. Late answers still land in the cache."""
+        deadline = time.monotonic() + (self.budget if budget is None else budget)
+        futures = {q: self.submit(q) for q in dict.fromkeys(queries)}
+        wait(list(futures.values()), timeout=max(0.0, deadline - time.monotonic()))
+        out = []
+        for q in queries:
+            f = futures[q]
+            if f.done():
+                out.append(f.result())
+            else:
+                self._timeouts.inc()
+                out.append(TIMED_OUT)
+        return out
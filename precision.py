@@ -0,0 +1,42 @@
+# margo-ml/precision.py
+# Load-time inference precision for the generator and embedder:
+#   MARGO_INFER_PRECISION=fp32 (default) | bf16 | int8-dynamic
+import logging
+import os
+
+import torch
+from transformers.pytorch_utils import Conv1D
+
+PRECISIONS = ("fp32", "bf16", "int8-dynamic")
+INFER_PRECISION = os.getenv("MARGO_INFER_PRECISION", "fp32").lower()
+
+
+def _conv1d_to_linear(module: torch.nn.Module) -> None:
+    # GPT-2 uses transformers' Conv1D (weight stored as in x out) instead of
+    # nn.Linear, which quantize_dynamic would otherwise leave untouched.
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            nx, nf = child.weight.shape
+            linear = torch.nn.Linear(nx, nf)
+            linear.weight = torch.nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = torch.nn.Parameter(child.bias.detach().clone())
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def apply_precision(model: torch.nn.Module, mode: str = INFER_PRECISION, device: str = "cpu") -> torch.nn.Module:
+    """Returns `model` converted to `mode`. int8-dynamic is CPU only; on other
+    devices the model is returned unchanged."""
+    if mode not in PRECISIONS:
+        raise ValueError(f"MARGO_INFER_PRECISION must be one of {PRECISIONS}, got {mode!r}")
+    model.eval()
+    if mode == "bf16":
+        return model.to(torch.bfloat16)
+    if mode == "int8-dynamic":
+        if not str(device).startswith("cpu"):
+            logging.getLogger(__name__).warning("int8-dynamic is CPU only; keeping fp32 on %s", device)
+            return model
+        _conv1d_to_linear(model)
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
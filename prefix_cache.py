@@ -0,0 +1,83 @@
+# margo-ml/prefix_cache.py
+# Reuses the key/values of the constant prompt prefix across generate() calls,
+# so per-request prefill only covers the variable part of the prompt.
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+PREFIX_CACHE = os.getenv("MARGO_PREFIX_CACHE", "1") != "0"
+
+
+
+def _legacy(past) -> tuple:
+    # ((k, v), ...) from a model's past_key_values, across transformers versions
+    if isinstance(past, tuple):
+        return past
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    return tuple((layer.keys, layer.values) for layer in past.layers)
+
+
+def _dynamic(legacy: tuple) -> DynamicCache:
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    return DynamicCache(ddp_cache_data=legacy)
+
+
+class PrefixKVCache:
+    """Batches are laid out as [prefix][left padding][suffix]. The prefix
+    positions are identical for every row, so one precomputed past can be
+    broadcast over the batch; GPT-2 derives position ids from the attention
+    mask, so the padding in the middle does not shift the suffix."""
+
+    def __init__(self, model, tokenizer, prefix: str, enabled: bool = PREFIX_CACHE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefix = prefix
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._prefix_ids: Optional[torch.Tensor] = None
+        self._past: Optional[tuple] = None  # legacy ((k, v), ...) with batch size 1
+
+    def warm(self) -> None:
+        if self._prefix_ids is not None:
+            return
+        with self._lock:
+            if self._prefix_ids is not None:
+                return
+            ids = self.tokenizer(self.prefix, return_tensors="pt").input_ids.to(self.model.device)
+            past = None
+            if self.enabled:
+                with torch.no_grad():
+                    past = self.model(ids, use_cache=True).past_key_values
+                past = _legacy(past)
+            self._past = past
+            self._prefix_ids = ids
+
+    def _suffixes(self, prompts: List[str]) -> Optional[List[str]]:
+        if all(p.startswith(self.prefix) for p in prompts):
+            return [p[len(self.prefix):] for p in prompts]
+        return None
+
+    def encode(self, prompts: List[str], n: int = 1) -> Tuple[torch.Tensor, torch.Tensor, Optional[DynamicCache]]:
+        """Returns (input_ids, attention_mask, past_key_values) for generate(),
+        with every prompt repeated `n` times (prompt-major)."""
+        self.warm()
+        device = self.model.device
+        suffixes = self._suffixes(prompts)
+        if suffixes is None:
+            enc = self.tokenizer(prompts, padding=True, return_tensors="pt").to(device)
+            return enc.input_ids.repeat_interleave(n, 0), enc.attention_mask.repeat_interleave(n, 0), None
+
+        enc = self.tokenizer(suffixes, padding=True, return_tensors="pt").to(device)
+        rows = len(prompts) * n
+        prefix_ids = self._prefix_ids.expand(rows, -1)
+        input_ids = torch.cat([prefix_ids, enc.input_ids.repeat_interleave(n, 0)], dim=1)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids), enc.attention_mask.repeat_interleave(n, 0)], dim=1)
+        past = None
+        if self._past is not None:
+            past = _dynamic(tuple((k.expand(rows, -1, -1, -1), v.expand(rows, -1, -1, -1)) for k, v in self._past))
+        return input_ids, attention_mask, past
@@ -0,0 +1,23 @@
+# margo-ml/prompts.py
+from models import GenerateRequest
+
+# Constant instructions go first so their key/values can be computed once and
+# reused (see prefix_cache.py); only the fragment after it varies per request.
+# The prefix ends right before a space so BPE splits it the same way whether it
+# is tokenized alone or together with the suffix.
+PROMPT_PREFIX = (
+    "Format: Title on first line. Then 'Ingredients:' with at least 2-3 specific items (e.g., 2 cups rice, 1 lb tofu, 1/2 tsp salt). Then 'Instructions:' with 4-6 numbered steps. Then 'Tips:'.\n"
+    "Create a unique"
+)
+
+
+def build_prompt(req: GenerateRequest) -> str:
+    diet_str = ', '.join(req.diet) or 'any'
+    tech_str = ', '.join(req.techniques) or 'simple'
+    cuisine_str = ', '.join(req.cuisine) or 'varied'
+    pantry_str = ', '.join(req.pantry) or 'basic staples'
+    return PROMPT_PREFIX + (
+        f" {diet_str} recipe for {req.servings} servings. "
+        f"Use {tech_str} methods, {cuisine_str} style. Budget: under ${req.budgetCents / 100:.2f}. "
+        f"Time: {req.minutes} minutes total. Include pantry: {pantry_str}.\n"
+    )
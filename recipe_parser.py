@@ -0,0 +1,203 @@
+# margo-ml/recipe_parser.py
+# Single-pass parser for generated recipe text. Lines are consumed once, in
+# order, either from a finished string (parse_recipe_text) or incrementally as
+# tokens are decoded (RecipeParser.feed), so generation can stop as soon as the
+# last section is complete.
+import re
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+from models import IngredientLine
+
+TITLE, INGREDIENTS, INSTRUCTIONS, TIPS = "title", "ingredients", "instructions", "tips"
+
+_HEADER = re.compile(
+    r"^\W*(?P<kw>ingredients?|instructions?|directions|method|steps|tips?|notes)\b\W*?:?\s*(?P<rest>.*)$",
+    re.IGNORECASE,
+)
+_HEADER_SECTION = {
+    "ingredient": INGREDIENTS, "ingredients": INGREDIENTS,
+    "instruction": INSTRUCTIONS, "instructions": INSTRUCTIONS, "directions": INSTRUCTIONS,
+    "method": INSTRUCTIONS, "steps": INSTRUCTIONS,
+    "tip": TIPS, "tips": TIPS, "notes": TIPS,
+}
+# a header line can only start with one of these (or with markup like "**")
+_HEADER_START = frozenset("iIdDmMsStTnN")
+_ORDER = {TITLE: 0, INGREDIENTS: 1, INSTRUCTIONS: 2, TIPS: 3}
+
+_UNICODE_FRACTIONS = {"½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4", "⅛": "1/8"}
+_WORD_QTY = {"a": 1.0, "an": 1.0, "one": 1.0, "two": 2.0, "three": 3.0, "four": 4.0, "half": 0.5, "quarter": 0.25}
+_UNITS = (
+    "teaspoons?|tsps?|tablespoons?|tbsps?|tbs|cups?|c|ounces?|oz|pounds?|lbs?|lb|grams?|g|kilograms?|kg|"
+    "milliliters?|ml|liters?|l|cans?|cloves?|pinch(?:es)?|dash(?:es)?|slices?|pieces?|bunch(?:es)?|"
+    "handfuls?|sprigs?|stalks?|heads?|packages?|pkg|jars?|ct|large|medium|small|whole"
+)
+_INGREDIENT = re.compile(
+    r"^\s*(?:[-*•]\s*|\d+[.)]\s+(?=\d))?"
+    r"(?:(?P<whole>\d+)\s+(?P<num>\d+)/(?P<den>\d+)|(?P<fnum>\d+)/(?P<fden>\d+)|(?P<dec>\d*\.?\d+)"
+    r"|(?P<word>an?|one|two|three|four|half|quarter)\b)?\s*"
+    r"(?P<unit>(?:" + _UNITS + r")\b\.?)?\s*(?:of\s+)?(?P<name>.*)$",
+    re.IGNORECASE,
+)
+_BULLET = re.compile(r"^\s*[-*•]\s*")
+_STEP = re.compile(r"^\s*(?:step\s*)?\d+\s*[.):-]\s*\S", re.IGNORECASE)
+
+
+def parse_qty(text: Optional[str]) -> Optional[float]:
+    """'2', '1.5', '1/2', '1 1/2', 'half' -> float; None if unparseable. No eval."""
+    if not text:
+        return None
+    t = text.strip().lower()
+    if t in _WORD_QTY:
+        return _WORD_QTY[t]
+    try:
+        return float(sum(Fraction(part) for part in t.split()))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _match_qty(m: "re.Match") -> Optional[float]:
+    # the regex already split the quantity, so no Fraction() round trip per line
+    if m.group("dec"):
+        return float(m.group("dec"))
+    if m.group("fnum"):
+        den = int(m.group("fden"))
+        return int(m.group("fnum")) / den if den else None
+    if m.group("whole"):
+        den = int(m.group("den"))
+        return int(m.group("whole")) + int(m.group("num")) / den if den else None
+    word = m.group("word")
+    return _WORD_QTY[word.lower()] if word else None
+
+
+def _split_ingredient(line: str) -> Optional[Tuple[str, Optional[float], Optional[str]]]:
+    if not line.isascii():
+        for sym, frac in _UNICODE_FRACTIONS.items():
+            line = line.replace(sym, f" {frac}")
+    m = _INGREDIENT.match(line)
+    if not m:
+        return None
+    unit = m.group("unit")
+    name = m.group("name").strip(" ,.-") or _BULLET.sub("", line)
+    return name, _match_qty(m), unit.rstrip(".").lower() if unit else None
+
+
+def parse_ingredient(line: str) -> Optional[IngredientLine]:
+    parts = _split_ingredient(line.strip())
+    return None if parts is None else IngredientLine(name=parts[0], qty=parts[1], unit=parts[2])
+
+
+class RecipeParser:
+    """Feed text in arbitrary chunks; complete lines are parsed as they arrive.
+
+    `complete` turns true once the Tips section has `max_tips_lines` lines or
+    is closed by a blank line, which is everything parse_recipe_text keeps."""
+
+    def __init__(self, max_tips_lines: Optional[int] = None):
+        self.max_tips_lines = max_tips_lines
+        self.section = TITLE
+        self.title: Optional[str] = None
+        self.ingredients: List[Tuple[str, Optional[float], Optional[str]]] = []  # (name, qty, unit)
+        self.instructions: List[str] = []
+        self.tips: List[str] = []
+        self.seen = {INGREDIENTS: False, INSTRUCTIONS: False, TIPS: False}
+        self.complete = False
+        self._ing_lines = 0
+        self._ing_with_qty = 0
+        self._steps = 0
+        self._buf = ""
+
+    def feed(self, chunk: str) -> bool:
+        self._buf += chunk
+        if "\n" in chunk:
+            *lines, self._buf = self._buf.split("\n")
+            for line in lines:
+                self._line(line)
+        return self.complete
+
+    def close(self) -> "RecipeParser":
+        if self._buf:
+            self._line(self._buf)
+            self._buf = ""
+        return self
+
+    def _line(self, raw: str) -> None:
+        if self.complete:
+            return
+        line = raw.strip()
+        m = _HEADER.match(line) if line and (line[0] in _HEADER_START or not line[0].isalnum()) else None
+        if m:
+            section = _HEADER_SECTION[m.group("kw").lower()]
+            # sections only move forward; a later "Ingredients" mention inside
+            # the steps is just text
+            if not self.seen[section] and _ORDER[section] > _ORDER[self.section]:
+                self.section = section
+                self.seen[section] = True
+                rest = m.group("rest")
+                if rest.strip():  # "Tips: serve warm" on one line
+                    self._content(rest.strip(), rest)
+                return
+        self._content(line, raw)
+
+    def _content(self, line: str, raw: str) -> None:
+        if self.section == TITLE:
+            if line and self.title is None:
+                self.title = line
+        elif self.section == INGREDIENTS:
+            if line:
+                ing = _split_ingredient(line)
+                if ing is not None:
+                    self._ing_lines += 1
+                    self._ing_with_qty += ing[1] is not None
+                    self.ingredients.append(ing)
+        elif self.section == INSTRUCTIONS:
+            if line:
+                self._steps += bool(_STEP.match(line))
+            self.instructions.append(raw)
+        else:
+            if line:
+                self.tips.append(raw)
+                if self.max_tips_lines and len(self.tips) >= self.max_tips_lines:
+                    self.complete = True
+            elif self.tips and self.max_tips_lines:
+                self.complete = True
+
+    @property
+    def usable(self) -> bool:
+        """A title, at least two parsed ingredient lines, some instructions and
+        a Tips section, i.e. nothing in the recipe comes from the fallbacks
+        below and the text was not cut off before its end."""
+        return (self.title is not None and self._ing_lines >= 2
+                and any(s.strip() for s in self.instructions) and any(t.strip() for t in self.tips))
+
+    def confidence(self) -> Dict[str, float]:
+        title = self.title or ""
+        return {
+            TITLE: 1.0 if 3 <= len(title) <= 120 else 0.0,
+            INGREDIENTS: (self._ing_with_qty / self._ing_lines) if self._ing_lines else 0.0,
+            INSTRUCTIONS: (min(1.0, self._steps / 4) if self._steps else (0.3 if any(s.strip() for s in self.instructions) else 0.0)),
+            TIPS: 1.0 if any(t.strip() for t in self.tips) else 0.0,
+        }
+
+    def result(self, pantry_str: str = "") -> Dict:
+        ingredients = [IngredientLine(name=name, qty=qty, unit=unit) for name, qty, unit in self.ingredients]
+        # Fallback to pantry items if the section exists but nothing parsed
+        if self.seen[INGREDIENTS] and not ingredients and pantry_str:
+            ingredients = [IngredientLine(name=item.strip(), qty=1.0, unit="") for item in pantry_str.split(', ')]
+        instructions = "\n".join(self.instructions).strip("\n") if self.seen[INSTRUCTIONS] else "Follow standard steps."
+        tips = "\n".join(self.tips).strip("\n") if self.seen[TIPS] else "Adjust spices to taste."
+        return {
+            'title': self.title or "Generated Recipe",
+            'ingredients': ingredients,
+            'instructions': instructions,
+            'tips': tips,
+            'confidence': self.confidence(),
+            'usable': self.usable,
+        }
+
+
+def parse_recipe_text(gen_text: str, pantry_str: str = "") -> Dict:
+    parser = RecipeParser()
+    for line in gen_text.split("\n"):
+        parser._line(line)
+    return parser.result(pantry_str)
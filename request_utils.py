@@ -0,0 +1,16 @@
+# margo-ml/request_utils.py
+import uuid
+from typing import Optional
+from fastapi import Request
+
+def user_uuid_from_headers(request: Request) -> Optional[str]:
+    for key in ("x-user-id", "x-user-uuid", "x-user"):
+        v = request.headers.get(key)
+        if not v:
+            continue
+        try:
+            _ = uuid.UUID(v)
+            return v
+        except Exception:
+            pass
+    return None
@@ -0,0 +1,124 @@
+# margo-ml/result_cache.py
+# Seeded /generate_ml requests are deterministic for a given model setup, so
+# their recipes are cached under a canonical hash of the request plus that
+# setup. Identical requests arriving together share one generation.
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+import metrics
+from models import GenerateRequest
+
+RESULT_CACHE_SIZE = int(os.getenv("MARGO_RESULT_CACHE_SIZE", "1024"))  # 0 disables
+RESULT_CACHE_TTL_S = float(os.getenv("MARGO_RESULT_CACHE_TTL_S", "86400"))
+
+
+def _norm_list(items) -> list:
+    return sorted({" ".join(str(i).lower().split()) for i in items if str(i).strip()})
+
+
+def request_key(req: GenerateRequest, model_version: str) -> Optional[str]:
+    """sha256 of the normalized request and model version; None when unseeded
+    (sampling is then random and nothing can be reused)."""
+    if req.seed is None:
+        return None
+    canon = {
+        "pantry": _norm_list(req.pantry), "diet": _norm_list(req.diet), "avoid": _norm_list(req.avoid),
+        "techniques": _norm_list(req.techniques), "cuisine": _norm_list(req.cuisine),
+        "budgetCents": req.budgetCents, "minutes": req.minutes, "servings": req.servings,
+        "seed": req.seed, "model": model_version,
+    }
+    return hashlib.sha256(json.dumps(canon, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def source_id_for(key: str) -> int:
+    # recipes.source_id is a BIGINT; 60 bits of the key identify the request
+    return int(key[:15], 16)
+
+
+class ResultCache:
+    """TTL + LRU map of request key -> recipe dict, with the recipe id stored
+    for each user who received it."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl_s: float = RESULT_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # key -> [expires_at, recipe, {user: id}]
+        self._inflight: Dict[str, Future] = {}
+        self._key_locks = [threading.Lock() for _ in range(64)]
+        self._hits = metrics.counter("result_cache.hits")
+        self._misses = metrics.counter("result_cache.misses")
+        self._coalesced = metrics.counter("result_cache.coalesced")
+        metrics.gauge("result_cache.entries", lambda: len(self._entries))
+
+    def _live(self, key: str) -> Optional[list]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict]) -> Dict:
+        """A copy of the cached recipe, computing it at most once per key even
+        when identical requests arrive concurrently."""
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None:
+                self._hits.inc()
+                return dict(entry[1])
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+                self._misses.inc()
+            else:
+                self._coalesced.inc()
+        if not owner:
+            return dict(fut.result())
+        try:
+            recipe = compute()
+            recipe.pop("id", None)
+            self._put(key, recipe)
+            fut.set_result(recipe)
+            return dict(recipe)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _put(self, key: str, recipe: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = [time.monotonic() + self.ttl, recipe, {}]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lock_for(self, key: str) -> threading.Lock:
+        return self._key_locks[int(key[:8], 16) % len(self._key_locks)]
+
+    def stored_id(self, key: str, user_id: Optional[str]) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key)
+            return entry[2].get(user_id) if entry is not None else None
+
+    def remember_id(self, key: str, user_id: Optional[str], recipe_id: str) -> None:
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None:
+                entry[2][user_id] = recipe_id
+
+
+result_cache = ResultCache()
@@ -0,0 +1,38 @@
+# margo-ml/search.py
+# Nearest-neighbour lookups over stored recipe embeddings (db_service's
+# HNSW / IVFFlat index): recipes like a stored one, and free-text search.
+import uuid
+from typing import Callable, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from db_service import Session, search_recipes, similar_recipes
+from models import RecipeSearchRequest, SimilarRecipeOut
+
+
+def make_router(embed_query: Optional[Callable[[str], List[float]]] = None) -> APIRouter:
+    # `embed_query` maps query text to a recipe-space embedding; without it
+    # (the torch-free entry point) only /recipes/{id}/similar is served
+    router = APIRouter()
+
+    @router.get("/recipes/{recipe_id}/similar", response_model=List[SimilarRecipeOut])
+    def similar(recipe_id: str, k: int = Query(10, ge=1, le=100), source: Optional[str] = None,
+                tag: List[str] = Query(default_factory=list)):
+        try:
+            uuid.UUID(recipe_id)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="recipe not found")
+        out = similar_recipes(recipe_id, k=k, source=source, tags=tag, session_factory=Session)
+        if out is None:
+            raise HTTPException(status_code=404, detail="recipe not found or not embedded")
+        return out
+
+    if embed_query is not None:
+        @router.post("/recipes/search", response_model=List[SimilarRecipeOut])
+        def search(req: RecipeSearchRequest):
+            if not req.query.strip():
+                raise HTTPException(status_code=422, detail="query is empty")
+            return search_recipes(embed_query(req.query), k=req.k, source=req.source, tags=req.tags,
+                                  session_factory=Session)
+
+    return router
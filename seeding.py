@@ -0,0 +1,23 @@
+# margo-ml/seeding.py
+# Per-request randomness. Nothing here touches the global `random` or torch
+# RNGs, so concurrent requests cannot perturb each other's sequences.
+import hashlib
+import os
+import random
+from typing import Optional
+
+
+def derive_seed(seed: int, *path) -> int:
+    """A 63-bit seed for item `path` of a request seeded with `seed`; stable
+    across processes and Python versions (unlike hash())."""
+    digest = hashlib.sha256(repr((seed,) + path).encode()).digest()
+    return int.from_bytes(digest[:8], "big") >> 1
+
+
+def fresh_seed() -> int:
+    return int.from_bytes(os.urandom(8), "big") >> 1
+
+
+def request_rng(seed: Optional[int]) -> random.Random:
+    # seed None -> seeded from the OS, like the module-level generator
+    return random.Random(seed)
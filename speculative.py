@@ -0,0 +1,76 @@
+# margo-ml/speculative.py
+# Assisted (speculative) generation: a small draft model from the same tokenizer
+# family proposes a few tokens, the generator verifies them in one forward pass.
+#   MARGO_DRAFT_MODEL=distilgpt2   (unset = off)
+#   MARGO_DRAFT_TOKENS=5           (initial proposals per round; adapted by transformers)
+import os
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+DRAFT_MODEL = os.getenv("MARGO_DRAFT_MODEL") or None
+DRAFT_TOKENS = int(os.getenv("MARGO_DRAFT_TOKENS", "5"))
+
+_draft_tokens = metrics.counter("speculative.draft_tokens")
+_accepted_tokens = metrics.counter("speculative.accepted_tokens")
+_verify_passes = metrics.counter("speculative.verify_passes")
+metrics.gauge("speculative.acceptance_rate",
+              lambda: _accepted_tokens.value / _draft_tokens.value if _draft_tokens.value else 0.0)
+_tokens_per_sec = metrics.histogram("generation.tokens_per_sec", [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+
+# Forward passes are counted by hooks that stay on the models, but only for
+# the measured generate() running on the same thread; unmeasured calls and
+# measured calls on other threads share the models without being counted.
+_local = threading.local()
+_hook_lock = threading.Lock()
+
+
+def compatible(model, draft) -> bool:
+    """The draft's token ids must mean the same as the generator's."""
+    return model.config.vocab_size == draft.config.vocab_size
+
+
+def observe_throughput(new_tokens: int, secs: float) -> None:
+    if secs > 0 and new_tokens:
+        _tokens_per_sec.observe(new_tokens / secs)
+
+
+class _Count:
+    # a class rather than a closure so hooked models still pickle for the inference pool
+    def __init__(self, role: str):
+        self.role = role
+
+    def __call__(self, module, args):
+        counts = getattr(_local, "counts", None)
+        if counts is not None:
+            counts[self.role] += 1
+
+
+def _hook(model, role: str) -> None:
+    with _hook_lock:
+        if not getattr(model, "_margo_counted", False):
+            model.register_forward_pre_hook(_Count(role))
+            model._margo_counted = True
+
+
+@contextmanager
+def measure(model, draft):
+    """Counts forward passes of both models during one assisted generate().
+
+    Each draft forward proposes one token; each generator forward verifies a
+    round of proposals and emits the accepted ones plus one token of its own,
+    so accepted = new tokens - generator passes. Yields a dict whose
+    "new_tokens" the caller fills in before leaving the block."""
+    _hook(model, "main")
+    _hook(draft, "draft")
+    counts = {"main": 0, "draft": 0}
+    result = {"new_tokens": 0}
+    _local.counts = counts
+    try:
+        yield result
+    finally:
+        _local.counts = None
+    _verify_passes.inc(counts["main"])
+    _draft_tokens.inc(counts["draft"])
+    _accepted_tokens.inc(min(counts["draft"], max(0, result["new_tokens"] - counts["main"])))
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from catalog_index import CatalogIndex, in_pantry  # noqa: E402
+
+BUDGET = 10 ** 6  # cents; high enough that only the other constraints filter
+
+
+def test_short_avoid_term_keeps_the_catalog():
+    index = CatalogIndex()
+    assert len(index.pool(4, BUDGET, [], ["a"], [], [])) == len(index.pool(4, BUDGET, [], [], [], []))
+
+
+def test_avoid_matches_whole_words():
+    index = CatalogIndex()
+    for flat in index.pool(4, BUDGET, [], ["pork", "egg"], [], []):
+        _, protein, _, _ = index.combo(flat)
+        assert protein["name"] not in ("Pork loin", "Eggs")
+
+
+def test_pantry_matches_whole_words():
+    assert in_pantry("Long-grain rice", ["long-grain rice"])
+    assert in_pantry("Olive oil", ["oil"])
+    assert not in_pantry("Boiled eggs", ["oil"])
@@ -0,0 +1,199 @@
+# margo-ml/write_behind.py
+# Write-behind persistence for generated recipes. The id is assigned up front
+# and returned at once; the row goes into a bounded in-process queue that a
+# background writer commits in multi-row batches.
+#   MARGO_WRITE_BEHIND=0                  1 = enqueue; 0 = commit before responding, as before
+#   MARGO_WRITE_BEHIND_QUEUE=10000        rows waiting to be written
+#   MARGO_WRITE_BEHIND_BATCH=500          rows per commit
+#   MARGO_WRITE_BEHIND_INTERVAL_MS=100    longest a row waits for its batch to fill
+#   MARGO_WRITE_BEHIND_RETRIES=5          attempts after a failed commit (exponential backoff)
+#   MARGO_WRITE_BEHIND_PUT_TIMEOUT_MS=500 how long a full queue may block a request
+# A row that cannot be queued within the put timeout is committed by the
+# request itself, so a slow database slows requests down instead of growing
+# memory. Rows are visible to reads (GET, fetch_recipes) once flushed.
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from db_service import DB_ASYNC, Session, insert_recipe_rows, recipe_values, store_recipe, store_recipes, store_recipes_async
+
+WRITE_BEHIND = os.getenv("MARGO_WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_QUEUE = int(os.getenv("MARGO_WRITE_BEHIND_QUEUE", "10000"))
+WRITE_BEHIND_BATCH = int(os.getenv("MARGO_WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("MARGO_WRITE_BEHIND_INTERVAL_MS", "100"))
+WRITE_BEHIND_RETRIES = int(os.getenv("MARGO_WRITE_BEHIND_RETRIES", "5"))
+WRITE_BEHIND_PUT_TIMEOUT_MS = float(os.getenv("MARGO_WRITE_BEHIND_PUT_TIMEOUT_MS", "500"))
+
+
+class WriteBehindQueue:
+    def __init__(self, session_factory=Session, max_rows: int = WRITE_BEHIND_QUEUE,
+                 batch_size: int = WRITE_BEHIND_BATCH, interval_ms: float = WRITE_BEHIND_INTERVAL_MS,
+                 retries: int = WRITE_BEHIND_RETRIES, put_timeout_ms: float = WRITE_BEHIND_PUT_TIMEOUT_MS):
+        self._session_factory = session_factory
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=max(1, max_rows))
+        self.batch_size = max(1, batch_size)
+        self.interval = max(0.0, interval_ms) / 1000.0
+        self.retries = max(0, retries)
+        self.put_timeout = max(0.0, put_timeout_ms) / 1000.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._oldest: Optional[float] = None  # enqueue time of the batch being written
+
+        self._lag_ms = metrics.histogram("write_behind.lag_ms")  # enqueue -> commit
+        self._batch_rows = metrics.histogram("write_behind.batch_rows", [1, 10, 50, 100, 250, 500, 1000])
+        self._written = metrics.counter("write_behind.rows_written")
+        self._retried = metrics.counter("write_behind.retries")
+        self._dropped = metrics.counter("write_behind.rows_dropped")
+        self._sync = metrics.counter("write_behind.sync_writes")  # queue full: written by the request
+        metrics.gauge("write_behind.queue_depth", self._queue.qsize)
+        metrics.gauge("write_behind.oldest_ms", self.oldest_ms)
+
+    def oldest_ms(self) -> float:
+        # how far behind the writer is: age of the oldest row not yet committed
+        oldest = self._oldest
+        try:
+            head = self._queue.queue[0][1]
+        except IndexError:
+            head = None
+        ages = [t for t in (oldest, head) if t is not None]
+        return (time.monotonic() - min(ages)) * 1000 if ages else 0.0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="margo-write-behind", daemon=True)
+                t.start()
+                self._thread = t
+
+    def store_recipes(self, recipes: List[Dict], user_id: Optional[str] = None, source: str = "margo-ml",
+                      source_id: Optional[int] = None) -> List[str]:
+        """Ids for `recipes` in input order; the rows are committed later."""
+        self._ensure_started()
+        rows = [recipe_values(r, user_id, source, source_id) for r in recipes]
+        for i, row in enumerate(rows):
+            try:
+                self._queue.put((row, time.monotonic()), timeout=self.put_timeout)
+            except queue.Full:
+                # backpressure: this request commits the rest itself
+                self._sync.inc(len(rows) - i)
+                self._write(rows[i:])
+                break
+        return [str(row["id"]) for row in rows]
+
+    def _write(self, rows: List[Dict]) -> None:
+        with self._session_factory() as session:
+            insert_recipe_rows(session, rows)
+            session.commit()
+
+    def _next_batch(self) -> List[tuple]:
+        try:
+            first = self._queue.get(timeout=self.interval or 0.05)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[1] + self.interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[tuple]) -> None:
+        self._oldest = batch[0][1]
+        for attempt in range(self.retries + 1):
+            try:
+                self._write([row for row, _ in batch])
+                break
+            except Exception:
+                if attempt == self.retries:
+                    logging.getLogger(__name__).exception(
+                        "write-behind: dropping %d recipe rows after %d attempts", len(batch), attempt + 1)
+                    self._dropped.inc(len(batch))
+                    self._oldest = None
+                    return
+                self._retried.inc()
+                time.sleep(min(5.0, 0.1 * 2 ** attempt))
+        now = time.monotonic()
+        for _, enqueued_at in batch:
+            self._lag_ms.observe((now - enqueued_at) * 1000)
+        self._batch_rows.observe(len(batch))
+        self._written.inc(len(batch))
+        self._oldest = None
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Writes everything still queued, then stops the writer."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_writer: Optional[WriteBehindQueue] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteBehindQueue:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehindQueue()
+    return _writer
+
+
+def persist_recipes(recipes: List[Dict], user_id: Optional[str] = None, source: str = "margo-ml",
+                    session_factory=Session) -> List[str]:
+    # db_service.store_recipes, or queued when MARGO_WRITE_BEHIND=1
+    if not recipes:
+        return []
+    if not WRITE_BEHIND:
+        return store_recipes(recipes, user_id=user_id, source=source, session_factory=session_factory)
+    return get_writer().store_recipes(recipes, user_id=user_id, source=source)
+
+
+def persist_recipe(recipe: Dict, user_id: Optional[str] = None, source: str = "margo-ml",
+                   source_id: Optional[int] = None, session_factory=Session) -> str:
+    # db_service.store_recipe, or queued when MARGO_WRITE_BEHIND=1
+    if not WRITE_BEHIND:
+        return store_recipe(recipe, user_id=user_id, source=source, source_id=source_id,
+                            session_factory=session_factory)
+    return get_writer().store_recipes([recipe], user_id=user_id, source=source, source_id=source_id)[0]
+
+
+async def persist_recipes_async(recipes: List[Dict], user_id: Optional[str] = None, source: str = "margo-ml",
+                                source_id: Optional[int] = None) -> List[str]:
+    # For async endpoints: awaits the asyncpg commit when MARGO_DB_ASYNC=1;
+    # enqueueing (which may block on backpressure) and the sync engine run on
+    # the threadpool instead of the event loop
+    if not recipes:
+        return []
+    if WRITE_BEHIND:
+        return await run_in_threadpool(get_writer().store_recipes, recipes, user_id, source, source_id)
+    if DB_ASYNC:
+        return await store_recipes_async(recipes, user_id=user_id, source=source, source_id=source_id)
+    return await run_in_threadpool(store_recipes, recipes, user_id, source, source_id)
+
+
+async def persist_recipe_async(recipe: Dict, user_id: Optional[str] = None, source: str = "margo-ml",
+                               source_id: Optional[int] = None) -> str:
+    return (await persist_recipes_async([recipe], user_id=user_id, source=source, source_id=source_id))[0]
+
+
+def shutdown() -> None:
+    if _writer is not None:
+        _writer.close()